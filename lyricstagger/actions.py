@@ -2,27 +2,78 @@
 Actions with musical files
 """
 
+import functools
+import typing
 import click
+import mutagen
+import lyricstagger.index as index
 import lyricstagger.log as log
 import lyricstagger.misc as misc
+import lyricstagger.probe as probe
 
 
-def tag(logger: log.CliLogger, filepath: str, overwrite: bool = False) -> None:
-    """Try to tag lyrics for given file"""
+# audio is None if tags were taken from index or probe,
+# file is opened only if we have lyrics to write
+Track = typing.NamedTuple("Track", [("filepath", str),
+                                     ("audio", mutagen.FileType),
+                                     ("data", typing.Dict[str, str])])
+
+
+def load(filepath: str) -> typing.Tuple[mutagen.FileType, typing.Dict[str, str]]:
+    """Load file and its tags, remembering them in index"""
     audio = misc.get_audio(filepath)
     data = misc.get_tags(audio)
+    index.update(filepath, data, misc.has_lyrics(audio))
+    return audio, data
+
+
+def inspect(filepath: str) -> index.Entry:
+    """Get tags and lyrics presence for file, from index if file
+    is unchanged, else probing tags header or loading whole file"""
+    entry = index.lookup(filepath)
+    if entry is not None:
+        return entry
+    entry = probe.probe(filepath)
+    if entry is None:
+        audio = misc.get_audio(filepath)
+        entry = index.Entry(misc.get_tags(audio), misc.has_lyrics(audio))
+    index.update(filepath, entry.data, entry.lyrics)
+    return entry
+
+
+def read(logger: log.CliLogger, filepath: str, overwrite: bool = False) -> Track:
+    """First stage of tag action: inspect file and return Track
+    if lyrics should be fetched for it"""
+    entry = inspect(filepath)
     # we cannot find lyrics if we don't have tags
-    if data:
-        if overwrite or "lyrics" not in data:
-            lyrics = misc.fetch(data["artist"],
-                                data["title"],
-                                data["album"])
-            if lyrics:
-                logger.log_writing(filepath)
-                audio = misc.write_lyrics(audio, lyrics)
-                audio.save()
-            else:
-                logger.log_not_found(filepath)
+    if entry.data and (overwrite or not entry.lyrics):
+        return Track(filepath, None, entry.data)
+    return None
+
+
+def write(logger: log.CliLogger, track: Track, lyrics: str) -> None:
+    """Last stage of tag action: save fetched lyrics for track"""
+    if lyrics:
+        audio = track.audio or misc.get_audio(track.filepath)
+        if misc.same_lyrics(audio, lyrics):
+            logger.log_unchanged(track.filepath)
+        else:
+            logger.log_writing(track.filepath)
+            audio = misc.write_lyrics(audio, lyrics)
+            logger.log_saved(track.filepath, misc.save_audio(audio))
+        index.update(track.filepath, track.data, True)
+    else:
+        logger.log_not_found(track.filepath)
+
+
+def tag(logger: log.CliLogger, filepath: str, overwrite: bool = False) -> None:
+    """Try to tag lyrics for given file"""
+    track = read(logger, filepath, overwrite)
+    if track:
+        lyrics = misc.fetch(track.data["artist"],
+                            track.data["title"],
+                            track.data["album"])
+        write(logger, track, lyrics)
 
 
 def tag_force(logger: log.CliLogger, filepath: str) -> None:
@@ -32,28 +83,39 @@ def tag_force(logger: log.CliLogger, filepath: str) -> None:
 
 def remove(logger: log.CliLogger, filepath: str) -> None:
     """Remove given file"""
-    audio = misc.get_audio(filepath)
-    logger.log_removing(filepath)
-    misc.remove_lyrics(audio)
-    audio.save()
+    entry = inspect(filepath)
+    audio = None
+    if entry.lyrics:
+        audio = misc.get_audio(filepath)
+    if audio is not None and misc.remove_lyrics(audio):
+        logger.log_removing(filepath)
+        logger.log_saved(filepath, misc.save_audio(audio))
+        index.update(filepath, entry.data, False)
+    else:
+        logger.log_unchanged(filepath)
 
 
 def edit(logger: log.CliLogger, filepath: str) -> None:
     """Edit given file's lyrics with EDITOR"""
     audio = misc.get_audio(filepath)
     lyrics = misc.edit_lyrics(audio)
-    if lyrics:
+    if lyrics and misc.same_lyrics(audio, lyrics):
+        logger.log_unchanged(filepath)
+    elif lyrics:
         logger.log_writing(filepath)
         audio = misc.write_lyrics(audio, lyrics)
-        audio.save()
+        logger.log_saved(filepath, misc.save_audio(audio))
+        index.update(filepath, misc.get_tags(audio), True)
     else:
         logger.log_no_lyrics_saved(filepath)
 
 
 def show(logger: log.CliLogger, filepath: str) -> None:
     """Pretty print lyrics from given file"""
-    audio = misc.get_audio(filepath)
-    data = misc.get_tags(audio)
+    entry = index.lookup(filepath)
+    data = None
+    if entry is None or entry.lyrics:
+        _, data = load(filepath)
     if data and "lyrics" in data:
         click.secho("%s" % click.format_filename(filepath), fg="blue")
         click.secho("Artist: %s, Title: %s" % (data["artist"],
@@ -69,11 +131,18 @@ def show(logger: log.CliLogger, filepath: str) -> None:
 
 def report(logger: log.CliLogger, filepath: str) -> None:
     """Show lyrics presence in given file"""
-    audio = misc.get_audio(filepath)
-    data = misc.get_tags(audio)
-    if data and 'lyrics' not in data:
+    entry = inspect(filepath)
+    if entry.data and not entry.lyrics:
         logger.log_not_found(filepath)
         click.secho("no lyrics:    ", nl=False, fg="red")
     else:
         click.secho("lyrics found: ", nl=False, fg="green")
     click.echo("%s" % click.format_filename(filepath))
+
+
+# tag actions split into read, fetch and write stages,
+# maps action to its read stage
+STAGES = {
+    tag: functools.partial(read, overwrite=False),
+    tag_force: functools.partial(read, overwrite=True),
+}
@@ -0,0 +1,131 @@
+"""
+Persistent cache of lyrics lookups
+
+Cache remembers lyrics found by helpers, and also lookups which found
+nothing, so next runs don't ask websites the same questions again.
+Found lyrics and misses expire after different time, as lyrics for
+missing songs can be added to websites later.
+"""
+import re
+import time
+import typing
+import lyricstagger.store as store
+
+# seconds to keep found lyrics
+HIT_TTL = 180 * 24 * 3600
+# seconds to remember that lyrics were not found
+MISS_TTL = 7 * 24 * 3600
+
+# returned by lookup when cache has no fresh entry
+MISSING = object()
+
+KeyType = typing.Tuple[str, str, str]
+
+
+def make_key(artist: str, song: str, album: str) -> KeyType:
+    """Normalize lookup parameters, so small differences
+    in tags don't make separate cache entries"""
+    return tuple(re.sub(r"\s+", " ", (value or "")).strip().lower()
+                 for value in (artist, song, album))
+
+
+class Cache(store.Store):
+    """Thread-safe lyrics cache stored in SQLite database"""
+    schema = ["CREATE TABLE IF NOT EXISTS lyrics ("
+              "artist TEXT, song TEXT, album TEXT, lyrics TEXT, "
+              "fetched REAL, PRIMARY KEY (artist, song, album))",
+              # pages of songs resolved by helpers, empty url for missing pages
+              "CREATE TABLE IF NOT EXISTS pages ("
+              "site TEXT, artist TEXT, song TEXT, url TEXT, "
+              "fetched REAL, PRIMARY KEY (site, artist, song))"]
+
+    def __init__(self, path: str, hit_ttl: float = HIT_TTL,
+                 miss_ttl: float = MISS_TTL):
+        store.Store.__init__(self, path)
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+
+    def lookup(self, artist: str, song: str, album: str) -> typing.Any:
+        """Get cached lyrics, None for cached miss,
+        or MISSING if lookup has to be done"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT lyrics, fetched FROM lyrics "
+                "WHERE artist = ? AND song = ? AND album = ?",
+                make_key(artist, song, album)).fetchone()
+        if row is None:
+            return MISSING
+        lyrics, fetched = row
+        ttl = self.hit_ttl if lyrics else self.miss_ttl
+        if time.time() - fetched > ttl:
+            return MISSING
+        return lyrics
+
+    def update(self, artist: str, song: str, album: str, lyrics: str) -> None:
+        """Remember lyrics found by lookup, None if nothing was found"""
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO lyrics VALUES (?, ?, ?, ?, ?)",
+                make_key(artist, song, album) + (lyrics or None, time.time()))
+            self.updated()
+
+    def lookup_page(self, site: str, artist: str, song: str) -> typing.Any:
+        """Get cached url of song page on site, empty string if page
+        is known to be missing, or MISSING if it has to be resolved"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT url, fetched FROM pages "
+                "WHERE site = ? AND artist = ? AND song = ?",
+                (site,) + make_key(artist, song, None)[:2]).fetchone()
+        if row is None:
+            return MISSING
+        url, fetched = row
+        ttl = self.hit_ttl if url else self.miss_ttl
+        if time.time() - fetched > ttl:
+            return MISSING
+        return url
+
+    def update_page(self, site: str, artist: str, song: str, url: str) -> None:
+        """Remember resolved url of song page, empty if it's missing"""
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                (site,) + make_key(artist, song, None)[:2] + (url, time.time()))
+            self.updated()
+
+
+# opened by engines for their runs, every lookup goes to websites
+# while it's closed
+SHARED = store.SharedStore("lyrics cache", Cache)
+start = SHARED.start
+stop = SHARED.stop
+
+
+def lookup(artist: str, song: str, album: str) -> typing.Any:
+    """Get cached lyrics, None for cached miss, MISSING if not cached"""
+    db = SHARED.store
+    if db is None:
+        return MISSING
+    return db.lookup(artist, song, album)
+
+
+def update(artist: str, song: str, album: str, lyrics: str) -> None:
+    """Remember lookup result if cache is open"""
+    db = SHARED.store
+    if db is not None:
+        db.update(artist, song, album, lyrics)
+
+
+def lookup_page(site: str, artist: str, song: str) -> typing.Any:
+    """Get cached song page url, empty if missing, MISSING if not cached"""
+    db = SHARED.store
+    if db is None:
+        return MISSING
+    return db.lookup_page(site, artist, song)
+
+
+def update_page(site: str, artist: str, song: str, url: str) -> None:
+    """Remember song page url if cache is open"""
+    db = SHARED.store
+    if db is not None:
+        db.update_page(site, artist, song, url)
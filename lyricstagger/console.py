@@ -1,7 +1,8 @@
 """lyricstagger
 
 Usage:
-  lyricstagger (tag|remove|report|edit|show) (<path>...)
+  lyricstagger (tag|remove|report|edit|show|watch) (<path>...)
+  lyricstagger import [--from-cache] [<dump>...]
   lyricstagger --help
   lyricstagger --version
 
@@ -16,12 +17,84 @@ for every found file.
   report                     Show all found files without lyrics tag.
   edit                       Edit lyrics for found files with EDITOR.
   show                       Print lyrics from found files to stdout.
+  watch                      Tag new and changed files as they appear.
+  import                     Add lyrics from JSONL or CSV dumps \
+to local database.
 """
 from __future__ import print_function
+import csv
+import os
 import click
 import typing
 import lyricstagger.actions as actions
 import lyricstagger.engine as engine
+import lyricstagger.helpers.local as local
+import lyricstagger.helpers.parsing as parsing
+import lyricstagger.misc as misc
+import lyricstagger.watch as watch
+
+# number of files found on previous runs, used as progressbar length
+COUNTS_FILE = os.path.join(misc.get_cache_dir(), "file_counts.json")
+# tags of processed files, used with --index
+INDEX_FILE = os.path.join(misc.get_cache_dir(), "index.sqlite")
+# lyrics found and not found on previous runs
+CACHE_FILE = os.path.join(misc.get_cache_dir(), "lyrics.sqlite")
+# helpers hit rate and latency, used with --adaptive
+RANKING_FILE = os.path.join(misc.get_cache_dir(), "helpers.json")
+# local lyrics database, asked before websites
+LIBRARY_FILE = os.path.join(misc.get_cache_dir(), "library.sqlite")
+
+
+class Threads(click.ParamType):
+    """Number of threads or 'auto' to adjust it while running"""
+    name = "threads"
+
+    def convert(self, value, param, ctx):
+        if value == "auto" or isinstance(value, int):
+            return value
+        try:
+            threads = int(value)
+        except ValueError:
+            self.fail("%s is not a valid integer or 'auto'" % value, param, ctx)
+        if threads < 1:
+            self.fail("%s is smaller than the minimum valid value 1" % value,
+                      param, ctx)
+        return threads
+
+
+def threads_options(threads: typing.Union[int, str]) -> typing.Dict[str, typing.Any]:
+    """Get engine options for --threads value"""
+    if threads == "auto":
+        return dict(threads=4, autoscale=True)
+    return dict(threads=threads)
+
+
+def index_file(use_index: bool) -> str:
+    """Path to index file if index is enabled"""
+    if use_index:
+        return INDEX_FILE
+    return None
+
+
+def cache_file(use_cache: bool) -> str:
+    """Path to lyrics cache file if cache is enabled"""
+    if use_cache:
+        return CACHE_FILE
+    return None
+
+
+def ranking_file(adaptive: bool) -> str:
+    """Path to helpers statistics file if helpers are reordered"""
+    if adaptive:
+        return RANKING_FILE
+    return None
+
+
+def library_file(use_library: bool) -> str:
+    """Path to local lyrics database if it is enabled"""
+    if use_library:
+        return LIBRARY_FILE
+    return None
 
 
 @click.group()
@@ -31,31 +104,165 @@ def main():
 
 
 @main.command('tag')
-@click.option('--threads', default=4, type=click.IntRange(1, None),
-              help='Number of threads to use.')
+@click.option('--threads', default="4", type=Threads(),
+              help='Number of threads to use '
+                   '(lyrics fetching threads for pipeline engine), '
+                   'or "auto" to adjust it by observed throughput.')
+@click.option('--engine', 'mode', default="threads",
+              type=click.Choice(engine.MODES),
+              help='Run lookups in threads, on asyncio event loop, '
+                   'in pipeline of reader, fetcher and writer threads, '
+                   'or in threads taking whole directories (albums).')
+@click.option('--concurrency', default=100, type=click.IntRange(1, None),
+              help='Number of lookups in flight for async engine.')
+@click.option('--readers', default=2, type=click.IntRange(1, None),
+              help='Number of tag reading threads for pipeline engine.')
+@click.option('--writers', default=2, type=click.IntRange(1, None),
+              help='Number of tag writing threads for pipeline engine.')
+@click.option('--queue-size', default=1000, type=click.IntRange(1, None),
+              help='Number of found files waiting to be processed.')
+@click.option('--parse-processes', default=0, type=click.IntRange(0, None),
+              help='Number of processes to parse html in '
+                   '(0 to parse in fetching threads).')
+@click.option('--parser', default=None, type=click.Choice(parsing.BACKENDS),
+              help='HTML parser to use, lxml by default if it is installed.')
+@click.option('--pool-size', default=None, type=click.IntRange(1, None),
+              help='Connections kept alive to each website '
+                   '(by default one for each fetching thread).')
+@click.option('--pages-cache-size', default=16, type=click.IntRange(1, None),
+              help='Megabytes of parsed website pages kept in memory.')
+@click.option('--hedge-delay', default=None, type=click.FloatRange(0, None),
+              help='Seconds to wait for helper before asking the next one '
+                   'at the same time (0 to ask all helpers at once), '
+                   'first found lyrics in helpers order are used.')
 @click.option('--force', default=False, is_flag=True,
               help='Overwrite existing lyrics.')
+@click.option('--cache/--no-cache', 'use_cache', default=True,
+              help='Remember lookups results, including songs without '
+                   'lyrics, and reuse them on next runs.')
+@click.option('--adaptive/--fixed-order', default=True,
+              help='Try first helpers which found lyrics faster '
+                   'for the artist on previous lookups.')
+@click.option('--library/--no-library', 'use_library', default=True,
+              help='Look for lyrics in local database before websites '
+                   '(filled by import command).')
+@click.option('--offline', default=False, is_flag=True,
+              help='Find lyrics only in cache and local database.')
+@click.option('--index/--no-index', 'use_index', default=False,
+              help='Remember tags of processed files and skip opening '
+                   'files not changed since previous run.')
 @click.argument("path_list", nargs=-1, type=click.Path(exists=True))
-def tag_command(threads: int, force: bool, path_list: typing.Iterable[str]):
+def tag_command(threads: typing.Union[int, str], mode: str, concurrency: int, readers: int,
+                writers: int, queue_size: int, parse_processes: int,
+                parser: str, pool_size: int, pages_cache_size: int,
+                hedge_delay: float, force: bool, use_index: bool,
+                use_cache: bool, adaptive: bool, use_library: bool,
+                offline: bool, path_list: typing.Iterable[str]):
     """Download lyrics and tag every file."""
     label = click.style(u"Tagging...", fg="blue")
     if force:
         action = actions.tag_force
     else:
         action = actions.tag
-    with engine.engine(threads=threads) as runner:
-        runner.run(path_list, action, progress=True, label=label)
+    with engine.engine(mode=mode, concurrency=concurrency,
+                       readers=readers, writers=writers,
+                       counts_file=COUNTS_FILE, queue_size=queue_size,
+                       parse_processes=parse_processes, parser=parser,
+                       pool_size=pool_size, hedge_delay=hedge_delay,
+                       pages_cache_size=pages_cache_size * 1024 * 1024,
+                       index_file=index_file(use_index),
+                       cache_file=cache_file(use_cache),
+                       ranking_file=ranking_file(adaptive),
+                       library_file=library_file(use_library),
+                       offline=offline,
+                       **threads_options(threads)) as runner:
+        runner.run(path_list, action, progress=True, label=label,
+                   keep_results=False)
 
 
 @main.command('remove')
-@click.option('--threads', default=4, type=click.IntRange(1, None),
-              help='Number of threads to use.')
+@click.option('--threads', default="4", type=Threads(),
+              help='Number of threads to use, '
+                   'or "auto" to adjust it by observed throughput.')
+@click.option('--queue-size', default=1000, type=click.IntRange(1, None),
+              help='Number of found files waiting to be processed.')
+@click.option('--index/--no-index', 'use_index', default=False,
+              help='Remember tags of processed files and skip opening '
+                   'files not changed since previous run.')
 @click.argument("path_list", nargs=-1, type=click.Path(exists=True))
-def remove_command(threads: int, path_list: typing.Iterable[str]):
+def remove_command(threads: typing.Union[int, str], queue_size: int,
+                   use_index: bool, path_list: typing.Iterable[str]):
     """Remove lyrics tags from every found file."""
     label = click.style(u"Removing lyrics tags...", fg="blue")
-    with engine.engine(threads=threads) as runner:
-        runner.run(path_list, actions.remove, progress=True, label=label)
+    with engine.engine(counts_file=COUNTS_FILE, queue_size=queue_size,
+                       index_file=index_file(use_index),
+                       **threads_options(threads)) as runner:
+        runner.run(path_list, actions.remove, progress=True, label=label,
+                   keep_results=False)
+
+
+@main.command('watch')
+@click.option('--threads', default="4", type=Threads(),
+              help='Number of threads to use, '
+                   'or "auto" to adjust it by observed throughput.')
+@click.option('--delay', default=2.0, type=click.FloatRange(0, None),
+              help='Seconds file should stay unchanged before tagging.')
+@click.option('--cache/--no-cache', 'use_cache', default=True,
+              help='Remember lookups results, including songs without '
+                   'lyrics, and reuse them on next runs.')
+@click.option('--adaptive/--fixed-order', default=True,
+              help='Try first helpers which found lyrics faster '
+                   'for the artist on previous lookups.')
+@click.option('--library/--no-library', 'use_library', default=True,
+              help='Look for lyrics in local database before websites '
+                   '(filled by import command).')
+@click.option('--index/--no-index', 'use_index', default=False,
+              help='Remember tags of processed files and skip opening '
+                   'files not changed since previous run.')
+@click.argument("path_list", nargs=-1, type=click.Path(exists=True))
+def watch_command(threads: typing.Union[int, str], delay: float,
+                  use_cache: bool, adaptive: bool, use_library: bool,
+                  use_index: bool,
+                  path_list: typing.Iterable[str]):
+    """Tag new and changed files as they appear."""
+    try:
+        watcher = watch.Watcher(path_list, delay)
+    except OSError as error:
+        raise click.ClickException("Can't watch for changes: %s" % error)
+    with engine.engine(index_file=index_file(use_index),
+                       cache_file=cache_file(use_cache),
+                       ranking_file=ranking_file(adaptive),
+                       library_file=library_file(use_library),
+                       **threads_options(threads)) as runner, watcher:
+        try:
+            for batch in watcher.batches():
+                runner.run(batch, actions.tag, keep_results=False)
+        except KeyboardInterrupt:
+            pass
+
+
+@main.command('import')
+@click.option('--from-cache', default=False, is_flag=True,
+              help='Also add lyrics found on previous runs.')
+@click.argument("dump_list", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+def import_command(from_cache: bool, dump_list: typing.Iterable[str]):
+    """Add lyrics from JSONL or CSV dumps to local database.
+
+    Every record needs artist, song (or title) and lyrics,
+    album is optional."""
+    library = local.Library(LIBRARY_FILE)
+    try:
+        for dump in dump_list:
+            try:
+                count = library.import_file(dump)
+            except (OSError, UnicodeDecodeError, csv.Error) as error:
+                raise click.ClickException("Can't import %s: %s" % (dump, error))
+            click.echo("Imported %d songs from %s" % (count, dump))
+        if from_cache and os.path.exists(CACHE_FILE):
+            count = library.import_cache(CACHE_FILE)
+            click.echo("Imported %d songs from cache" % count)
+    finally:
+        library.close()
 
 
 @main.command('edit')
@@ -64,7 +271,7 @@ def edit_command(path_list: typing.Iterable[str]):
     """Edit lyrics for found files with EDITOR."""
     label = click.style(u"Manually editing lyrics tags...", fg="blue")
     with engine.engine(threads=1) as runner:
-        runner.run(path_list, actions.edit, label=label)
+        runner.run(path_list, actions.edit, label=label, keep_results=False)
 
 
 @main.command('show')
@@ -73,16 +280,19 @@ def show_command(path_list: typing.Iterable[str]):
     """Print lyrics from found files to stdout."""
     label = click.style(u"Showing lyrics...", fg="blue")
     with engine.engine(threads=1) as runner:
-        runner.run(path_list, actions.show, label=label)
+        runner.run(path_list, actions.show, label=label, keep_results=False)
 
 
 @main.command('report')
+@click.option('--index/--no-index', 'use_index', default=False,
+              help='Remember tags of processed files and skip opening '
+                   'files not changed since previous run.')
 @click.argument("path_list", nargs=-1, type=click.Path(exists=True))
-def report_command(path_list: typing.Iterable[str]):
+def report_command(use_index: bool, path_list: typing.Iterable[str]):
     """Report lyrics tag presence for musical files."""
     label = click.style(u"Status         Path", fg="blue")
-    with engine.engine(threads=1) as runner:
-        runner.run(path_list, actions.report, label=label)
+    with engine.engine(threads=1, index_file=index_file(use_index)) as runner:
+        runner.run(path_list, actions.report, label=label, keep_results=False)
 
 if __name__ == '__main__':
     main()
@@ -1,88 +1,709 @@
-from threading import Thread
+from threading import Event, Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import collections
+import itertools
+import os
+import time
 import typing
 import click
+import lyricstagger.actions as actions
+import lyricstagger.cache as cache
+import lyricstagger.index as index
 import lyricstagger.log as log
 import lyricstagger.misc as misc
+import lyricstagger.ranking as ranking
+import lyricstagger.shared as shared
+import lyricstagger.helpers as hlp
+import lyricstagger.helpers.local as local
+import lyricstagger.helpers.network as network
+import lyricstagger.helpers.parsing as parsing
 
 from queue import Queue
 
 ActionType = typing.Callable[[log.CliLogger, str], None]
 
+Result = typing.NamedTuple("Result", [("filepath", str),
+                                      ("states", typing.List[str]),
+                                      ("elapsed", float),
+                                      ("error", str)])
 
-class ActionThread(Thread):
-    """Thread to perform action"""
-    def __init__(self, logger: log.CliLogger, action: ActionType,
-                 file_queue: Queue, result_queue: Queue = None):
+# put into work queue to stop one of the threads reading it
+STOP = object()
+
+
+class Job(object):
+    """File processed by engine during one run"""
+    def __init__(self, action: ActionType, filepath: str, results: Queue):
+        self.action = action
+        self.filepath = filepath
+        # queue of the run this job belongs to
+        self.results = results
+        self.started = None  # type: float
+        self.track = None  # type: actions.Track
+        self.lyrics = None  # type: str
+        self.error = None  # type: str
+
+
+class AlbumJob(object):
+    """Files from one directory, usually one album, processed
+    by one thread, so album pages are fetched once for all tracks"""
+    def __init__(self, jobs: typing.List[Job]):
+        self.jobs = jobs
+        self.filepath = os.path.dirname(jobs[0].filepath)
+        self.error = None  # type: str
+
+
+class WorkStats(object):
+    """Thread-safe counters of work done by threads"""
+    def __init__(self):
+        self.lock = Lock()
+        self.done = 0
+        self.latency = 0.0
+        self.errors = 0
+
+    def record(self, latency: float, failed: bool) -> None:
+        with self.lock:
+            self.done += 1
+            self.latency += latency
+            if failed:
+                self.errors += 1
+
+    def take(self) -> typing.Tuple[int, float, int]:
+        """Return (done, total latency, errors) recorded since previous take"""
+        with self.lock:
+            result = (self.done, self.latency, self.errors)
+            self.done, self.latency, self.errors = 0, 0.0, 0
+            return result
+
+
+class StageThread(Thread):
+    """Thread to perform one stage of action for jobs
+
+    Stage returns True if job should go to the next stage,
+    or False if processing of this job is finished.
+    Thread exits before taking next job if retire returns True."""
+    def __init__(self, stage: typing.Callable[[Job], bool],
+                 in_queue: Queue, out_queue: Queue = None,
+                 finish: typing.Callable[[Job], None] = None,
+                 stats: WorkStats = None,
+                 retire: typing.Callable[[], bool] = None):
+        Thread.__init__(self)
+        self.stage = stage
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.finish = finish
+        self.stats = stats
+        self.retire = retire
+
+    def run(self):
+        while True:
+            if self.retire is not None and self.retire():
+                return
+            job = self.in_queue.get()
+            if job is STOP:
+                self.in_queue.task_done()
+                return
+            started = time.monotonic()
+            failed = False
+            try:
+                passed = self.stage(job)
+            except Exception as error:
+                log.warning("Failed to process '%s': %s", job.filepath, error)
+                job.error = str(error)
+                passed = False
+                failed = True
+            if self.stats:
+                self.stats.record(time.monotonic() - started, failed)
+            if passed and self.out_queue is not None:
+                self.out_queue.put(job)
+            elif self.finish:
+                self.finish(job)
+            self.in_queue.task_done()
+
+
+class Autoscaler(Thread):
+    """Thread adding workers while throughput grows,
+    and removing them when latency climbs or errors start"""
+    # seconds between measurements
+    interval = 2.0
+    # relative change of throughput or latency we consider significant
+    tolerance = 0.1
+
+    def __init__(self, start_worker: typing.Callable[[], None],
+                 stop_worker: typing.Callable[[], None], stats: WorkStats,
+                 workers: int, maximum: int):
         Thread.__init__(self)
+        self.start_worker = start_worker
+        self.stop_worker = stop_worker
+        self.stats = stats
+        self.workers = workers
+        self.maximum = maximum
+        self.stopped = Event()
+        self.network_errors = network.STATS["errors"]
+        self.throughput = 0.0
+        self.latency = None  # type: float
+        self.last_change = 0
+        self.adding = True
+
+    def adjust(self, done: int, latency: float, errors: int, elapsed: float) -> int:
+        """Decide how to change number of workers, return -1, 0 or 1"""
+        if not done:
+            return 0
+        change = self._decide(done / elapsed, latency / done, errors)
+        self.last_change = change
+        return change
+
+    def _decide(self, throughput: float, latency: float, errors: int) -> int:
+        previous, self.throughput = self.throughput, throughput
+        previous_latency, self.latency = self.latency, latency
+        # latency depends on kind of work (skipped files or lookups) more
+        # than on number of workers, so it's compared only with previous
+        # interval, to see if worker we just added made things slower
+        climbing = (self.last_change > 0 and previous_latency is not None and
+                    latency > previous_latency * (1 + 5 * self.tolerance))
+        if errors or climbing:
+            self.adding = False
+            return -1
+        if throughput > previous * (1 + self.tolerance):
+            # last change helped, keep going in the same direction
+            return 1 if self.adding else -1
+        if throughput < previous * (1 - self.tolerance):
+            # last change made things worse, go back
+            self.adding = not self.adding
+            return 1 if self.adding else -1
+        return 0
+
+    def run(self):
+        started = time.monotonic()
+        while not self.stopped.wait(self.interval):
+            now = time.monotonic()
+            done, latency, errors = self.stats.take()
+            # failed and throttled requests count as errors too
+            network_errors = network.STATS["errors"]
+            errors += network_errors - self.network_errors
+            self.network_errors = network_errors
+            change = self.adjust(done, latency, errors, now - started)
+            started = now
+            if change > 0 and self.workers < self.maximum:
+                log.debug("Adding worker, %d running", self.workers)
+                self.workers += 1
+                self.start_worker()
+            elif change < 0 and self.workers > 1:
+                log.debug("Removing worker, %d running", self.workers)
+                self.workers -= 1
+                self.stop_worker()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class WorkerPool(object):
+    """Threads performing stage for jobs from in_queue,
+    started once and reused by all runs until stopped"""
+    def __init__(self, stage: typing.Callable[[Job], bool], threads: int,
+                 in_queue: Queue, out_queue: Queue = None,
+                 finish: typing.Callable[[Job], None] = None,
+                 autoscale: bool = False, max_threads: int = 64):
+        self.stage = stage
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.finish = finish
+        self.lock = Lock()
+        self.threads = []  # type: typing.List[StageThread]
+        # threads to exit before taking next job, STOP put into in_queue
+        # would wait until all jobs queued before it are taken
+        self.retiring = 0
+        self.stats = WorkStats() if autoscale else None
+        for _ in range(threads):
+            self.add_worker()
+        self.scaler = None
+        if autoscale:
+            self.scaler = Autoscaler(self.add_worker, self.remove_worker,
+                                     self.stats, threads, max_threads)
+            self.scaler.daemon = True
+            self.scaler.start()
+
+    def add_worker(self) -> None:
+        trd = StageThread(self.stage, self.in_queue, self.out_queue,
+                          self.finish, self.stats, self._retire)
+        # daemon, so forgotten pool doesn't keep process running
+        trd.daemon = True
+        trd.start()
+        with self.lock:
+            self.threads = [each for each in self.threads if each.is_alive()]
+            self.threads.append(trd)
+
+    def remove_worker(self) -> None:
+        """Stop one thread once it finishes its current job"""
+        with self.lock:
+            self.retiring += 1
+
+    def _retire(self) -> bool:
+        with self.lock:
+            if not self.retiring:
+                return False
+            self.retiring -= 1
+            return True
+
+    def stop(self) -> None:
+        """Stop all threads after they finish jobs already queued"""
+        if self.scaler:
+            self.scaler.stop()
+        with self.lock:
+            self.retiring = 0
+            threads = [each for each in self.threads if each.is_alive()]
+        for _ in threads:
+            self.in_queue.put(STOP)
+        for each in threads:
+            each.join()
+
+
+class ScanThread(Thread):
+    """Thread to put jobs for files found in path_list into file_queue"""
+    def __init__(self, path_list: typing.Iterable[str], action: ActionType,
+                 file_queue: Queue, results: Queue, progress: "Progress",
+                 threads: int = 8, albums: bool = False):
+        Thread.__init__(self)
+        self.path_list = path_list
+        self.threads = threads
         self.action = action
-        self.logger = logger
         self.file_queue = file_queue
-        self.result_queue = result_queue
+        self.results = results
+        self.progress = progress
+        # put files from one directory into queue as one AlbumJob
+        self.albums = albums
 
     def run(self):
-        while True:
-            filepath = self.file_queue.get()
-            self.logger.log_processing(filepath)
-            self.action(self.logger, filepath)
-            self.file_queue.task_done()
-            if self.result_queue:
-                self.result_queue.put(filepath)
+        file_list = misc.get_file_list(self.path_list, self.threads)
+        if self.albums:
+            # walk yields files of directory one after another
+            for _, album in itertools.groupby(file_list, os.path.dirname):
+                jobs = [Job(self.action, filepath, self.results)
+                        for filepath in album]
+                # counted before workers can finish them,
+                # so progressbar length never gets below position
+                for _ in jobs:
+                    self.progress.add_found()
+                self.file_queue.put(AlbumJob(jobs))
+        else:
+            for filepath in file_list:
+                self.progress.add_found()
+                self.file_queue.put(Job(self.action, filepath, self.results))
+        # None in results tells that scan is finished
+        self.results.put(None)
+
+
+class Progress(object):
+    """Progressbar which length grows while files are being found,
+    starting from number of files expected from previous run"""
+    def __init__(self, progressbar=None, expected: int = 0):
+        self.progressbar = progressbar
+        self.expected = expected
+        self.found = 0
+        self.processed = 0
+        self.scanned = False
+
+    def add_found(self) -> None:
+        self.found += 1
+
+    def finish_scan(self) -> None:
+        self.scanned = True
+        self._resize()
+
+    def update(self, count: int) -> None:
+        self.processed += count
+        self._resize()
+        if self.progressbar:
+            self.progressbar.update(count)
+
+    def finished(self) -> bool:
+        return self.scanned and self.processed >= self.found
+
+    def _resize(self) -> None:
+        if not self.progressbar:
+            return
+        if self.scanned:
+            self.progressbar.length = self.found
+        else:
+            # progressbar is finished once position reaches length,
+            # so while more files can be found it stays above position
+            self.progressbar.length = max(self.expected, self.found + 1)
+
+
+MODES = ["threads", "async", "pipeline", "albums"]
 
 
 class engine(object):
-    """Engine runs actions, for many files, in parallel"""
-    def __init__(self, threads: int = 4):
+    """Engine runs actions, for many files, in parallel
+
+    In "threads" mode every thread runs the whole action for a file.
+    In "async" mode lyrics are fetched by coroutines on event loop,
+    keeping up to `concurrency` lookups in flight, while tags are read
+    and written by `threads` executor threads, files are found by scanning
+    thread, and html is parsed in default executor of the loop.
+    In "pipeline" mode tags are read by `readers` threads, lyrics are
+    fetched by `threads` threads and written by `writers` threads,
+    with bounded queues between these stages.
+    In "albums" mode every thread takes all files of one directory,
+    reads their tags and fetches lyrics for tracks grouped by artist
+    and album, so pages of the album are fetched once.
+    With `autoscale` number of action threads (or fetching threads
+    in "pipeline" mode) starts from `threads` and is adjusted while running.
+
+    Threads are started by first run and reused by next ones,
+    until engine is closed (or used as context manager)."""
+    def __init__(self, threads: int = 4, mode: str = "threads",
+                 concurrency: int = 100, readers: int = 2,
+                 writers: int = 2, counts_file: str = None,
+                 queue_size: int = 1000, parse_processes: int = 0,
+                 autoscale: bool = False, max_threads: int = 64,
+                 scan_threads: int = 8, index_file: str = None,
+                 cache_file: str = None, pool_size: int = None,
+                 parser: str = None, hedge_delay: float = None,
+                 ranking_file: str = None, library_file: str = None,
+                 offline: bool = False, pages_cache_size: int = None):
         self.logger = log.CliLogger()
         self.threads = threads
+        self.mode = mode
+        self.concurrency = concurrency
+        self.readers = readers
+        self.writers = writers
+        self.counts_file = counts_file
+        # files waiting for workers, scanning blocks when queue is full,
+        # so memory doesn't grow with library size
+        self.queue_size = queue_size
+        # number of processes to parse html in, 0 to parse in fetching threads
+        self.parse_processes = parse_processes
+        # start with `threads` threads, then change their number
+        # up to max_threads, measuring throughput and latency
+        self.autoscale = autoscale
+        self.max_threads = max_threads
+        # number of directories listed at once while scanning
+        self.scan_threads = scan_threads
+        # SQLite index of files tags, unchanged files are not opened
+        self.index_file = index_file
+        # SQLite cache of lookups results, shared by all helpers
+        self.cache_file = cache_file
+        # connections kept alive to each website,
+        # by default one for each fetching thread
+        self.pool_size = pool_size
+        # html parser backend, default is the fastest installed one
+        self.parser = parser
+        # seconds before asking next helper while previous one is still
+        # working, None to ask helpers one after another
+        self.hedge_delay = hedge_delay
+        # JSON file with helpers hit rate and latency,
+        # helpers are tried in fixed order without it
+        self.ranking_file = ranking_file
+        # SQLite database of lyrics asked before websites
+        self.library_file = library_file
+        # find lyrics only in cache and local database
+        self.offline = offline
+        # bytes of parsed pages kept in memory by each helper
+        self.pages_cache_size = pages_cache_size
+        self._lock = Lock()
+        self._started = False
+        self._file_queue = None  # type: Queue
+        self._pools = []  # type: typing.List[WorkerPool]
+        self._executor = None  # type: ThreadPoolExecutor
+        # process-wide resources acquired by start
+        self._shared = []  # type: typing.List[shared.Shared]
 
     def __enter__(self):
         return self
 
     def __exit__(self, *_):
+        # connections are counted while session is open
+        summary = network.summary()
+        self.close()
         click.echo(self.logger.show_stats())
+        if network.STATS["requests"]:
+            click.echo(summary)
+        cache_stats = hlp.cache_stats()
+        if cache_stats["hits"] or cache_stats["misses"]:
+            click.echo(hlp.cache_summary(cache_stats))
 
-    def _massive_action_with_progress(self, path_list: typing.Iterable[str],
-                                      action: ActionType, label: str = "") -> None:
-        """Run action function in threads for each file in path_list with progressbar"""
-        file_queue = Queue()
-        result_queue = Queue()
-        for _ in range(self.threads):
-            trd = ActionThread(self.logger, action, file_queue, result_queue)
-            trd.setDaemon(True)
-            trd.start()
-
-        # get length of generator without converting it to list,
-        # saves memory on large file lists, but can be a bit slower
-        max_files = sum(1 for _ in misc.get_file_list(path_list))
-
-        for filepath in misc.get_file_list(path_list):
-            file_queue.put(filepath)
-
-        with click.progressbar(label=label,
-                               length=max_files) as progressbar:
-            for _ in progressbar:
-                result_queue.get()
-
-        file_queue.join()
-
-    def _massive_action(self, path_list: typing.Iterable[str],
-                        action: ActionType, label: str = "") -> None:
-        """Run action function in threads for each file in path_list"""
-        file_queue = Queue()
-        for _ in range(self.threads):
-            trd = ActionThread(self.logger, action, file_queue)
-            trd.setDaemon(True)
-            trd.start()
-        if label:
-            click.echo(label)
-        for filepath in misc.get_file_list(path_list):
-            file_queue.put(filepath)
-        file_queue.join()
+    def start(self) -> None:
+        """Start workers, first run does it if not called before"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            try:
+                self._acquire_shared()
+            except Exception:
+                self._release_shared()
+                self._started = False
+                raise
+            if self.mode == "async":
+                self._executor = ThreadPoolExecutor(max_workers=self.threads)
+                return
+            self._file_queue = Queue(maxsize=self.queue_size)
+            if self.mode == "pipeline":
+                # bounded queues between stages, so fast stage
+                # can't pile up work waiting for the slow one
+                fetch_queue = Queue(maxsize=2 * self.threads)
+                write_queue = Queue(maxsize=2 * self.writers)
+                self._pools = [
+                    WorkerPool(self._read_stage, self.readers,
+                               self._file_queue, fetch_queue, self._finish),
+                    WorkerPool(self._fetch_stage, self.threads,
+                               fetch_queue, write_queue, self._finish,
+                               self.autoscale, self.max_threads),
+                    WorkerPool(self._write_stage, self.writers,
+                               write_queue, None, self._finish),
+                ]
+            elif self.mode == "albums":
+                self._pools = [
+                    WorkerPool(self._album_stage, self.threads,
+                               self._file_queue, None, None,
+                               self.autoscale, self.max_threads),
+                ]
+            else:
+                self._pools = [
+                    WorkerPool(self._action_stage, self.threads,
+                               self._file_queue, None, self._finish,
+                               self.autoscale, self.max_threads),
+                ]
 
-    def run(self, path_list: typing.Iterable[str], action: ActionType,
-            progress: bool = False, label: str = "") -> None:
-        """Selector for _massive_action functions"""
+    def close(self) -> None:
+        """Stop workers after all runs are finished"""
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+            for pool in self._pools:
+                pool.stop()
+            self._pools = []
+            if self._executor:
+                self._executor.shutdown()
+                self._executor = None
+            self._release_shared()
+
+    def _acquire_shared(self) -> None:
+        """Open process-wide resources used by lookups, or start using
+        ones opened by other engines"""
+        resources = []  # type: typing.List[typing.Tuple[shared.Shared, typing.Any]]
+        if self.index_file:
+            resources.append((index.SHARED, self.index_file))
+        if self.cache_file:
+            resources.append((cache.SHARED, self.cache_file))
+        if self.ranking_file:
+            resources.append((ranking.SHARED, self.ranking_file))
+        if self.library_file:
+            resources.append((local.SHARED, self.library_file))
+        if self.pool_size:
+            resources.append((network.SHARED_SESSION, self.pool_size))
+        elif self.autoscale:
+            resources.append((network.SHARED_SESSION, self.max_threads))
+        else:
+            resources.append((network.SHARED_SESSION, self.threads))
+        if self.parser:
+            resources.append((parsing.SHARED_BACKEND, self.parser))
+        if self.parse_processes:
+            resources.append((parsing.SHARED_POOL, self.parse_processes))
+        if self.pages_cache_size:
+            resources.append((hlp.SHARED_CACHE_SIZE, self.pages_cache_size))
+        resources.append((misc.SHARED_HEDGE_DELAY, self.hedge_delay))
+        resources.append((misc.SHARED_OFFLINE, self.offline))
+        for resource, key in resources:
+            resource.acquire(key)
+            self._shared.append(resource)
+
+    def _release_shared(self) -> None:
+        while self._shared:
+            self._shared.pop().release()
+
+    def _begin(self, job: Job) -> None:
+        job.started = time.monotonic()
+        self.logger.track(job.filepath)
+        self.logger.log_processing(job.filepath)
+
+    def _finish(self, job: Job) -> None:
+        states = self.logger.untrack(job.filepath)
+        elapsed = 0.0
+        if job.started is not None:
+            elapsed = time.monotonic() - job.started
+        job.results.put(Result(job.filepath, states, elapsed, job.error))
+
+    def _action_stage(self, job: Job) -> bool:
+        self._begin(job)
+        job.action(self.logger, job.filepath)
+        return False
+
+    def _read_stage(self, job: Job) -> bool:
+        reader = actions.STAGES.get(job.action)
+        if reader is None:
+            # action can't be split into stages, run it whole
+            return self._action_stage(job)
+        self._begin(job)
+        job.track = reader(self.logger, job.filepath)
+        return job.track is not None
+
+    def _fetch_stage(self, job: Job) -> bool:
+        job.lyrics = misc.fetch(job.track.data["artist"],
+                                job.track.data["title"],
+                                job.track.data["album"])
+        return True
+
+    def _write_stage(self, job: Job) -> bool:
+        actions.write(self.logger, job.track, job.lyrics)
+        return False
+
+    def _try_stage(self, stage: typing.Callable[[Job], bool], job: Job) -> bool:
+        """Run stage for job, failed job doesn't go to the next stage"""
+        try:
+            return stage(job)
+        except Exception as error:
+            log.warning("Failed to process '%s': %s", job.filepath, error)
+            job.error = str(error)
+            return False
+
+    def _album_stage(self, album: AlbumJob) -> bool:
+        fetching = []
+        for job in album.jobs:
+            if self._try_stage(self._read_stage, job):
+                fetching.append(job)
+            else:
+                self._finish(job)
+        # tracks of one album one after another, so pages fetched
+        # for the first track are found in helpers caches by the rest
+        fetching.sort(key=lambda job: (job.track.data.get("artist") or "",
+                                       job.track.data.get("album") or ""))
+        for job in fetching:
+            if self._try_stage(self._fetch_stage, job):
+                self._try_stage(self._write_stage, job)
+            self._finish(job)
+        return False
+
+    def _progressbar(self, path_list: typing.List[str], label: str):
+        """Progressbar with length from previous run on path_list"""
+        expected = 0
+        if self.counts_file:
+            expected = misc.load_file_count(self.counts_file, path_list)
+        return click.progressbar(label=label, length=expected)
+
+    def _save_count(self, path_list: typing.List[str], progress: Progress) -> None:
+        if self.counts_file:
+            misc.save_file_count(self.counts_file, path_list, progress.found)
+
+    async def _process_async(self, session, job: Job) -> None:
+        """Run action for one job, fetching lyrics with coroutines
+        if action supports stages"""
+        loop = asyncio.get_event_loop()
+        try:
+            if await loop.run_in_executor(self._executor, self._read_stage, job):
+                job.lyrics = await misc.fetch_async(job.track.data["artist"],
+                                                    job.track.data["title"],
+                                                    job.track.data["album"],
+                                                    session)
+                await loop.run_in_executor(self._executor, self._write_stage, job)
+        except Exception as error:
+            log.warning("Failed to process '%s': %s", job.filepath, error)
+            job.error = str(error)
+        finally:
+            # even cancelled job gets result, so run doesn't wait for it forever
+            self._finish(job)
+
+    async def _run_async(self, path_list: typing.Iterable[str],
+                         action: ActionType, results: Queue,
+                         progress: Progress) -> None:
+        """Feed files from path_list to `concurrency` worker coroutines"""
+        file_queue = asyncio.Queue(maxsize=self.queue_size)
+        session = network.async_session(self.concurrency)
+
+        async def worker():
+            while True:
+                job = await file_queue.get()
+                try:
+                    await self._process_async(session, job)
+                finally:
+                    file_queue.task_done()
+
+        loop = asyncio.get_event_loop()
+
+        def scan():
+            # listing directories blocks, so it's done by other thread
+            # waiting for room in the queue while coroutines work
+            for filepath in misc.get_file_list(path_list, self.scan_threads):
+                progress.add_found()
+                asyncio.run_coroutine_threadsafe(
+                    file_queue.put(Job(action, filepath, results)), loop).result()
+
+        workers = [loop.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            with ThreadPoolExecutor(max_workers=1) as scanner:
+                await loop.run_in_executor(scanner, scan)
+            # None in results tells that scan is finished
+            results.put(None)
+            await file_queue.join()
+        finally:
+            for each in workers:
+                each.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if session is not None:
+                await session.close()
+
+    def _run_loop(self, path_list: typing.List[str], action: ActionType,
+                  results: Queue, progress: Progress) -> None:
+        """Run event loop processing files from path_list"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(
+                self._run_async(path_list, action, results, progress))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def _results(self, path_list: typing.List[str], action: ActionType,
+                 progress: Progress) -> typing.Iterator[Result]:
+        """Feed files from path_list to workers and yield their results"""
+        self.start()
+        results = Queue()
+        if self.mode == "async":
+            feeder = Thread(target=self._run_loop,
+                            args=(path_list, action, results, progress))
+        else:
+            feeder = ScanThread(path_list, action, self._file_queue,
+                                results, progress, self.scan_threads,
+                                self.mode == "albums")
+        feeder.daemon = True
+        feeder.start()
+        while not progress.finished():
+            result = results.get()
+            if result is None:
+                progress.finish_scan()
+            else:
+                progress.update(1)
+                yield result
+        feeder.join()
+
+    def iter_run(self, path_list: typing.Iterable[str], action: ActionType,
+                 progress: bool = False, label: str = "") -> typing.Iterator[Result]:
+        """Run action for each file in path_list, yielding results
+        as soon as files are processed"""
+        # path_list is walked once, but also used as key for file counts
+        path_list = list(path_list)
         if progress:
-            self._massive_action_with_progress(path_list, action, label)
+            with self._progressbar(path_list, label) as progressbar:
+                files_progress = Progress(progressbar, progressbar.length)
+                yield from self._results(path_list, action, files_progress)
+            self._save_count(path_list, files_progress)
         else:
-            self._massive_action(path_list, action, label)
+            if label:
+                click.echo(label)
+            yield from self._results(path_list, action, Progress())
+
+    def run(self, path_list: typing.Iterable[str], action: ActionType,
+            progress: bool = False, label: str = "",
+            keep_results: bool = True) -> typing.Iterator[Result]:
+        """Run action for each file in path_list and wait for all of them,
+        return iterator over results, empty if keep_results is not set"""
+        results = self.iter_run(path_list, action, progress, label)
+        if keep_results:
+            return iter(list(results))
+        collections.deque(results, maxlen=0)
+        return iter(())
@@ -1,5 +1,44 @@
 """init helpers"""
+import typing
+import lyricstagger.shared as shared
+from . local import Local
 from . wikia import Wikia
 from . darklyrics import DarkLyrics
-__all__ = ['wikia', 'darklyrics']
-HELPERS = [Wikia(), DarkLyrics()]
+from . import darklyrics
+from . import network
+__all__ = ['local', 'wikia', 'darklyrics', 'network', 'parsing']
+# local database goes first, websites are asked only when it has no lyrics
+HELPERS = [Local(), Wikia(), DarkLyrics()]
+for _helper in HELPERS:
+    if _helper.url:
+        network.set_limit(_helper.url, _helper.rate, _helper.max_concurrent)
+
+
+def set_cache_size(size: int) -> None:
+    """Limit memory taken by pages cached by each helper"""
+    for helper in HELPERS:
+        if isinstance(helper, DarkLyrics):
+            helper.cache.resize(size)
+
+
+# set by engines for their runs, engines share size
+# set by the first one whatever size they want
+SHARED_CACHE_SIZE = shared.Shared("pages cache size", set_cache_size,
+                                  lambda: set_cache_size(darklyrics.CACHE_SIZE),
+                                  strict=False)
+
+
+def cache_stats() -> typing.Dict[str, int]:
+    """Get counters of pages caches of all helpers"""
+    total = dict(hits=0, misses=0, evictions=0, size=0, entries=0)
+    for helper in HELPERS:
+        if isinstance(helper, DarkLyrics):
+            for name, value in helper.cache.stats().items():
+                total[name] += value
+    return total
+
+
+def cache_summary(stats: typing.Dict[str, int]) -> str:
+    """Describe usage of pages caches"""
+    return "Pages cache hits: %d, misses: %d, evicted: %d, memory used: %d KiB" % (
+        stats["hits"], stats["misses"], stats["evictions"], stats["size"] // 1024)
@@ -2,82 +2,117 @@
 Helper to download lyrics from darklyrics.com
 """
 from __future__ import unicode_literals
+from concurrent.futures import Future
 from threading import Lock
+import collections
 import re
+import sys
+import typing
 import requests
-from bs4 import BeautifulSoup, NavigableString, Tag, Comment
+from bs4 import NavigableString, Tag, Comment
 import lyricstagger.log as log
+from . import network, parsing
+
+# returned by cache for keys it doesn't have
+MISSING = object()
+# memory taken by cached pages of one helper by default
+CACHE_SIZE = 16 * 1024 * 1024
+
+# song header on album page, like "1. Song Title"
+SONG_HEADER = re.compile(r"^\d+\.\s+(.*)$")
+
+
+def normalize(title: str) -> str:
+    """Make song or album title key for lookups in parsed pages"""
+    return " ".join(title.split()).lower()
 
 
 class Cache(object):
-    """Simple thread-safe cache based on dict"""
-    def __init__(self):
-        self.dict = {}
+    """Thread-safe LRU cache of parsed artist and album pages,
+    limited by approximate memory taken by stored strings"""
+    def __init__(self, max_size: int = CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        # (value, size) by key, least recently used first
+        self.entries = collections.OrderedDict()  # type: collections.OrderedDict
         self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-    def __getitem__(self, key):
-        with self.lock:
-            return self.dict[key]
-
-    def __setitem__(self, key, value):
+    @staticmethod
+    def _size(value: typing.Any) -> int:
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(
+                sys.getsizeof(key) + sys.getsizeof(item)
+                for key, item in value.items())
+        return sys.getsizeof(value)
+
+    def get(self, key: typing.Tuple[str, ...]) -> typing.Any:
+        """Get cached value, or MISSING if it's not in cache"""
         with self.lock:
-            self.dict[key] = value
-
-    def __delitem__(self, key):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return MISSING
+
+    def put(self, key: typing.Tuple[str, ...], value: typing.Any) -> None:
+        """Cache value, evicting least recently used ones if cache is full"""
+        size = self._size(value)
         with self.lock:
-            del self.dict[key]
-
-    def __contains__(self, item):
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            self._evict()
+
+    def resize(self, max_size: int) -> None:
+        """Change memory limit, evicting entries above new one"""
         with self.lock:
-            return item in self.dict
+            self.max_size = max_size
+            self._evict()
 
-    def set_artist_page(self, artist: str, page: str):
-        if artist in self:
-            self[artist]["page"] = page
-        else:
-            self[artist] = dict(page=page, album_pages=dict())
+    def _evict(self) -> None:
+        while self.size > self.max_size and len(self.entries) > 1:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
 
-    def get_artist_page(self, artist: str) -> str:
-        if artist in self:
-            return self[artist]["page"]
-        else:
-            return ""
-
-    def has_artist(self, artist: str) -> bool:
-        return artist in self
-
-    def get_album_page(self, artist: str, album: str) -> str:
-        if artist in self:
-            if album in self[artist]["album_pages"]:
-                return self[artist]["album_pages"][album]
-
-        return None
+    def stats(self) -> typing.Dict[str, int]:
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        evictions=self.evictions, size=self.size,
+                        entries=len(self.entries))
 
-    def set_album_page(self, artist: str, album: str, page: str):
-        if artist in self:
-            self[artist]["album_pages"][album] = page
-        else:
-            self[artist] = dict(page="", album_pages=dict(album=page))
+    def get_artist(self, artist: str) -> typing.Dict[str, str]:
+        """Get artist albums links, None if artist is missing on website"""
+        return self.get(("artist", artist))
 
-    def has_album_page(self, artist, album):
-        if artist in self:
-            if album in self[artist]["album_pages"]:
-                return True
-        return False
+    def get_album(self, artist: str, album: str) -> typing.Dict[str, str]:
+        """Get album songs lyrics, None if album is missing on website"""
+        return self.get(("album", artist, album))
 
 
 class DarkLyrics(object):
     """Lyrics Downloader for darklyrics.com"""
     url = "http://www.darklyrics.com"
-
-    def __init__(self):
-        self.cache = Cache()
+    # requests per second and concurrent requests tolerated by website
+    rate = 2.0
+    max_concurrent = 2
+
+    def __init__(self, cache_size: int = CACHE_SIZE):
+        self.cache = Cache(cache_size)
+        # futures of artist and album lookups in progress
+        self.inflight = dict()  # type: typing.Dict[typing.Tuple[str, ...], Future]
+        self.lock = Lock()
 
     @staticmethod
-    def parse(text: str, song: str) -> str:
-        """Parse lyrics from html"""
-        # parse the result
-        soup = BeautifulSoup(text, "html.parser")
+    def parse_album(text: str) -> typing.Dict[str, str]:
+        """Parse lyrics of all songs from album page html,
+        return dict of lyrics by normalized song title"""
+        soup = parsing.make_soup(text, "div", "lyrics")
         lyrics_div = soup.find('div', "lyrics")
         if lyrics_div is None:
             log.debug("BeautifulSoup failed to find 'lyrics' div")
@@ -86,35 +121,51 @@ class DarkLyrics(object):
         for element in lyrics_div(text=lambda txt: isinstance(txt, Comment)):
             element.extract()
 
-        lyrics = ''
-        song_found = False
+        songs = dict()
+        instrumental = set()
+        lyrics = None
         for content in lyrics_div.contents:
             if content.name == "h3":
-                if content.string and re.match(r"^\d+\.\s+%s$" % song, content.string, re.I):
-                    song_found = True
-                    continue
-                else:
-                    if song_found:
-                        break
-                    song_found = False
-            if song_found:
-                if isinstance(content, NavigableString):
-                    lyrics += content.strip()
-                elif isinstance(content, Tag):
-                    if (content.string and content.name == "i" and
-                            content.string.startswith("[Instrumental]")):
-                        return '{{Instrumental}}'
-                    elif content.name == "br":
-                        lyrics += '\n'
-                    if content.name not in ['script', 'a', 'div'] and content.string:
-                        lyrics += content.string.strip()
-        return lyrics.strip()
+                match = SONG_HEADER.match(content.string or "")
+                lyrics = None
+                if match:
+                    title = normalize(match.group(1))
+                    # first song with the same title wins
+                    if title not in songs:
+                        lyrics = songs[title] = []
+                continue
+            if lyrics is None:
+                continue
+            if isinstance(content, NavigableString):
+                lyrics.append(content.strip())
+            elif isinstance(content, Tag):
+                if (content.string and content.name == "i" and
+                        content.string.startswith("[Instrumental]")):
+                    instrumental.add(title)
+                elif content.name == "br":
+                    lyrics.append('\n')
+                if content.name not in ['script', 'a', 'div'] and content.string:
+                    lyrics.append(content.string.strip())
+        for title in songs:
+            if title in instrumental:
+                songs[title] = '{{Instrumental}}'
+            else:
+                songs[title] = ''.join(songs[title]).strip()
+        return songs
+
+    @staticmethod
+    def parse(text: str, song: str) -> str:
+        """Parse lyrics from html"""
+        songs = DarkLyrics.parse_album(text)
+        if songs is None:
+            return None
+        return songs.get(normalize(song), '')
 
     @staticmethod
     def parse_artist_link(data: str) -> str:
         """Parse search page and return link to artist page"""
 
-        soup = BeautifulSoup(data, "html.parser")
+        soup = parsing.make_soup(data, "div", "cont")
         cont_div = soup.find('div', "cont")
         if not cont_div:
             log.debug("BeautifulSoup failed to find 'cont' div")
@@ -143,108 +194,152 @@ class DarkLyrics(object):
         return link
 
     @staticmethod
-    def parse_album_link(data: str, album: str) -> str:
-        """Parse artist page and return link to album page"""
-
-        soup = BeautifulSoup(data, "html.parser")
+    def parse_albums(data: str) -> typing.Dict[str, str]:
+        """Parse artist page, return dict of links to album pages
+        by normalized album title"""
+        soup = parsing.make_soup(data, "div", "album")
         album_divs = soup.find_all('div', "album")
         if not album_divs:
             log.debug("BeautifulSoup failed to find 'album' divs")
             return None
 
-        link = ""
-
-        album_found = False
+        albums = dict()
         for div in album_divs:
+            title = None
             for content in div:
                 if content.name == "h2":
                     if content.string:
                         possible_album = content
                     else:
                         possible_album = content.find("strong")
-                    log.debug(possible_album)
-                    if possible_album and re.match(r'"?%s"?' % album, possible_album.string, re.I):
-                        album_found = True
-                        continue
-                    else:
-                        if album_found:
-                            break
-                        album_found = False
-                if album_found:
-                    log.debug(content)
-                    if content.name == 'a':
-                        link_a = content
-                    else:
-                        link_a = content.find('a')
-                    if isinstance(link_a, Tag):
-                        replaced = re.sub(r"#\d+|\.\.", "", link_a['href'])
-                        return DarkLyrics.url + replaced
+                    title = None
+                    if possible_album and possible_album.string:
+                        title = normalize(possible_album.string.strip('"'))
+                        if title in albums:
+                            title = None
+                    continue
+                if title is None:
+                    continue
+                if content.name == 'a':
+                    link_a = content
+                else:
+                    link_a = content.find('a')
+                if isinstance(link_a, Tag):
+                    replaced = re.sub(r"#\d+|\.\.", "", link_a['href'])
+                    albums[title] = DarkLyrics.url + replaced
+                    title = None
+        return albums
 
-        return link
+    @staticmethod
+    def find_album_link(albums: typing.Dict[str, str], album: str) -> str:
+        """Get link to album page from parsed artist page,
+        album can be the beginning of title on website"""
+        key = normalize(album)
+        if key in albums:
+            return albums[key]
+        for title, link in albums.items():
+            if title.startswith(key):
+                return link
+        return ""
 
     @staticmethod
-    def get_link_content(link: str) -> str:
-        """Perform request and return response text or None"""
+    def parse_album_link(data: str, album: str) -> str:
+        """Parse artist page and return link to album page"""
+        albums = DarkLyrics.parse_albums(data)
+        if albums is None:
+            return None
+        return DarkLyrics.find_album_link(albums, album)
+
+    @staticmethod
+    def link_content_steps(link: str) -> network.StepsType:
+        """Request step returning response text or None"""
         log.debug("Fetching %s" % link)
-        result = requests.get(link)
+        result = yield network.Request(link, None)
         if result.status_code != 200:
             log.debug("Got code %d" % result.status_code)
             return None
         return result.text
 
-    def _get_artist_page(self, artist: str) -> str:
-        if self.cache.has_artist(artist):
-            page = self.cache.get_artist_page(artist)
-            if page:
-                log.debug("Found artist '%s' page in cache" % artist)
-                return page
-            else:
-                log.debug("Skipping artist '%s' because we know it's missing on website" % artist)
-                return None
-        else:
-            search_page = self.get_link_content(DarkLyrics.url + "/search?q=" + artist)
-            artist_link = self.parse_artist_link(search_page)
-            if not artist_link:
-                log.debug("Failed to find artist link")
-                # mark this artist in cache as unavailable
-                self.cache.set_artist_page(artist, "")
-                return None
-            artist_page = self.get_link_content(artist_link)
-            log.debug("Adding artist '%s' page to cache" % artist)
-            self.cache.set_artist_page(artist, artist_page)
-            return artist_page
-
-    def _get_album_page(self, artist: str, album: str) -> str:
-        if self.cache.has_album_page(artist, album):
-            album_page = self.cache.get_album_page(artist, album)
-            if album_page:
-                log.debug("Found album '%s' page in cache" % album)
-                return album_page
-            else:
-                log.debug("Skipping album '%s' because we know it's missing on website" % artist)
-                return None
-        else:
-            artist_page = self._get_artist_page(artist)
-            if artist_page:
-                album_link = self.parse_album_link(artist_page, album)
-                if not album_link:
-                    log.debug("Failed to find album link")
-                    # mark this album in cache as unavailable
-                    self.cache.set_album_page(artist, album, "")
-                    return None
-                album_page = self.get_link_content(album_link)
-                log.debug("Adding album '%s' page to cache" % album)
-                self.cache.set_album_page(artist, album, album_page)
-                return album_page
-            else:
-                return None
+    @staticmethod
+    def get_link_content(link: str) -> str:
+        """Perform request and return response text or None"""
+        return network.run(DarkLyrics.link_content_steps(link))
+
+    def _single_flight_steps(self, key: typing.Tuple[str, ...],
+                             steps_func: typing.Callable[..., network.StepsType],
+                             *args) -> network.StepsType:
+        """Get value from cache or run steps to get it and cache it.
+        Concurrent lookups of the same key wait for the first one
+        instead of making the same requests"""
+        with self.lock:
+            value = self.cache.get(key)
+            if value is not MISSING:
+                log.debug("Found %s in cache" % (key,))
+                return value
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+        if not owner:
+            log.debug("Waiting for concurrent lookup of %s" % (key,))
+            return (yield future)
+        try:
+            value = yield from steps_func(*args)
+            # value is None if it's missing on website, we remember it too
+            log.debug("Adding %s to cache" % (key,))
+            self.cache.put(key, value)
+            future.set_result(value)
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            if not future.done():
+                # steps were closed before they finished
+                future.set_exception(requests.ConnectionError("Lookup was interrupted"))
+        return value
+
+    def _artist_steps(self, artist: str) -> network.StepsType:
+        search_page = yield from self.link_content_steps(DarkLyrics.url + "/search?q=" + artist)
+        artist_link = yield from parsing.parse_steps(self.parse_artist_link, search_page)
+        if not artist_link:
+            log.debug("Failed to find artist link")
+            return None
+        artist_page = yield from self.link_content_steps(artist_link)
+        if not artist_page:
+            return None
+        return (yield from parsing.parse_steps(self.parse_albums, artist_page))
+
+    def _album_steps(self, artist: str, album: str) -> network.StepsType:
+        albums = yield from self._single_flight_steps(("artist", artist),
+                                                      self._artist_steps, artist)
+        if not albums:
+            log.debug("Skipping artist '%s' because it's missing on website" % artist)
+            return None
+        album_link = self.find_album_link(albums, album)
+        if not album_link:
+            log.debug("Failed to find album link")
+            return None
+        album_page = yield from self.link_content_steps(album_link)
+        if not album_page:
+            return None
+        return (yield from parsing.parse_steps(self.parse_album, album_page))
+
+    def fetch_steps(self, artist: str, song: str, album: str) -> network.StepsType:
+        """Request steps to fetch lyrics, return lyrics or None"""
+        songs = yield from self._single_flight_steps(("album", artist, album),
+                                                     self._album_steps, artist, album)
+        if songs:
+            log.debug("Looking up lyrics for '{0}' - '{1}'".format(artist, song))
+            return songs.get(normalize(song))
+        log.debug("Failed to parse lyrics")
+        return None
 
     def fetch(self, artist: str, song: str, album: str) -> str:
         """Fetch lyrics from remote url"""
+        return network.run(self.fetch_steps(artist, song, album))
 
-        album_page = self._get_album_page(artist, album)
-        if album_page:
-            log.debug("Parsing lyrics for '{0}' - '{1}'".format(artist, song))
-            return DarkLyrics.parse(album_page, song)
-        log.debug("Failed to parse lyrics")
-        return None
+    async def fetch_async(self, artist: str, song: str, album: str, session=None) -> str:
+        """Fetch lyrics from remote url without blocking event loop"""
+        return await network.run_async(self.fetch_steps(artist, song, album), session)
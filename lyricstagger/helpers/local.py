@@ -0,0 +1,177 @@
+"""
+Helper to find lyrics in local database
+
+Database is SQLite file filled with lyrics imported from JSONL or CSV
+dumps and from lyrics cache, so it answers lookups without network.
+Lyrics found by websites are kept only in cache until they are imported.
+Songs are found by normalized tags, or by full-text search of artist
+and title words, so punctuation differences don't matter.
+"""
+from __future__ import unicode_literals
+import csv
+import json
+import os
+import re
+import sqlite3
+import typing
+import lyricstagger.cache as cache
+import lyricstagger.log as log
+import lyricstagger.store as store
+
+Record = typing.Dict[str, str]
+
+
+def words(text: str) -> typing.List[str]:
+    return re.findall(r"\w+", (text or "").lower())
+
+
+def match_query(artist: str, song: str) -> str:
+    """Full-text query matching all words of artist and song"""
+    def phrases(text):
+        return " ".join('"%s"' % word for word in words(text))
+    return "artist : (%s) AND song : (%s)" % (phrases(artist), phrases(song))
+
+
+def read_records(path: str) -> typing.Iterator[Record]:
+    """Read lyrics records from CSV file with header,
+    or from JSONL file with JSON object on every line"""
+    with open(path, encoding="utf-8", newline="") as dump:
+        if os.path.splitext(path)[1].lower() == ".csv":
+            yield from csv.DictReader(dump)
+            return
+        for number, line in enumerate(dump, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                log.warning("Skipping line %d of %s: %s", number, path, error)
+                continue
+            if not isinstance(record, dict):
+                log.warning("Skipping line %d of %s: not a JSON object", number, path)
+                continue
+            yield record
+
+
+class Library(store.Store):
+    """Thread-safe lyrics database stored in SQLite file"""
+    schema = ["CREATE TABLE IF NOT EXISTS songs ("
+              "artist TEXT, song TEXT, album TEXT, lyrics TEXT, "
+              "PRIMARY KEY (artist, song, album))"]
+    # full-text search results checked for the same words
+    candidates = 10
+
+    def __init__(self, path: str):
+        store.Store.__init__(self, path)
+        self.fts = True
+        try:
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts "
+                            "USING fts5(artist, song, content='songs', "
+                            "content_rowid='rowid')")
+            # artist and song are never updated, rows are never removed,
+            # so inserts are all index has to follow
+            self.db.execute("CREATE TRIGGER IF NOT EXISTS songs_fts_insert "
+                            "AFTER INSERT ON songs BEGIN "
+                            "INSERT INTO songs_fts(rowid, artist, song) "
+                            "VALUES (new.rowid, new.artist, new.song); END")
+        except sqlite3.OperationalError as error:
+            log.debug("Full-text search is not available: %s", error)
+            self.fts = False
+        self.db.commit()
+
+    def lookup(self, artist: str, song: str, album: str) -> str:
+        """Find lyrics for song, from the same album if there are several"""
+        key = cache.make_key(artist, song, album)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT lyrics FROM songs WHERE artist = ? AND song = ? "
+                "ORDER BY album = ? DESC LIMIT 1", key).fetchone()
+            if row is not None:
+                return row[0]
+            if not self.fts or not words(artist) or not words(song):
+                return None
+            rows = self.db.execute(
+                "SELECT songs.artist, songs.song, songs.lyrics "
+                "FROM songs_fts JOIN songs ON songs.rowid = songs_fts.rowid "
+                "WHERE songs_fts MATCH ? ORDER BY rank LIMIT ?",
+                (match_query(artist, song), self.candidates)).fetchall()
+        # search finds titles with more words too, they are other songs
+        for found_artist, found_song, lyrics in rows:
+            if words(found_artist) == words(artist) and words(found_song) == words(song):
+                return lyrics
+        return None
+
+    def _add(self, artist: str, song: str, album: str, lyrics: str) -> None:
+        key = cache.make_key(artist, song, album)
+        # existing row is updated, not replaced, so it keeps its rowid
+        # in full-text index (upsert needs SQLite 3.24)
+        cursor = self.db.execute("INSERT OR IGNORE INTO songs VALUES (?, ?, ?, ?)",
+                                 key + (lyrics,))
+        if not cursor.rowcount:
+            self.db.execute("UPDATE songs SET lyrics = ? WHERE artist = ? "
+                            "AND song = ? AND album = ? AND lyrics IS NOT ?",
+                            (lyrics,) + key + (lyrics,))
+
+    def add(self, artist: str, song: str, album: str, lyrics: str) -> None:
+        """Remember lyrics for song"""
+        with self.lock:
+            self._add(artist, song, album, lyrics)
+            self.updated()
+
+    def add_records(self, records: typing.Iterable[Record]) -> int:
+        """Import records with artist, song (or title), album
+        and lyrics in one transaction, return number of imported songs"""
+        count = 0
+        with self.lock:
+            for record in records:
+                song = record.get("song") or record.get("title")
+                lyrics = record.get("lyrics")
+                if not record.get("artist") or not song or not lyrics:
+                    continue
+                self._add(record["artist"], song, record.get("album"), lyrics)
+                count += 1
+            self.commit()
+        return count
+
+    def import_file(self, path: str) -> int:
+        """Import JSONL or CSV dump, return number of imported songs"""
+        return self.add_records(read_records(path))
+
+    def import_cache(self, path: str) -> int:
+        """Import lyrics found on previous runs from lyrics cache"""
+        source = sqlite3.connect(path)
+        try:
+            rows = source.execute("SELECT artist, song, album, lyrics FROM lyrics "
+                                  "WHERE lyrics IS NOT NULL").fetchall()
+        finally:
+            source.close()
+        return self.add_records(dict(artist=artist, song=song, album=album, lyrics=lyrics)
+                                for artist, song, album, lyrics in rows)
+
+
+# opened by engines for their runs, Local helper finds nothing
+# while it's closed
+SHARED = store.SharedStore("local lyrics database", Library)
+start = SHARED.start
+stop = SHARED.stop
+
+
+class Local(object):
+    """Lyrics finder in local database"""
+    # not a website, requests are not limited
+    url = None
+    rate = None
+    max_concurrent = None
+
+    @staticmethod
+    def fetch(artist: str, song: str, album: str) -> str:
+        """Find lyrics in database"""
+        library = SHARED.store
+        if library is None or not artist or not song:
+            return None
+        return library.lookup(artist, song, album)
+
+    @staticmethod
+    async def fetch_async(artist: str, song: str, album: str, session=None) -> str:
+        """Find lyrics in database, lookup is fast enough for event loop"""
+        return Local.fetch(artist, song, album)
@@ -0,0 +1,304 @@
+"""
+Network access shared by helpers.
+
+Helpers describe their lookups as generators of request steps: each step
+yields a Request and receives back an object with status_code and text
+attributes, and the generator returns the result of the lookup.
+Step can also yield concurrent.futures.Future (e.g. parsing submitted
+to process pool, or lookup made by other thread) and receive back its result,
+or yield Call of CPU-bound function (e.g. parsing), which coroutines run
+in executor, so it doesn't block event loop.
+Request errors, HTTPError for throttled or failed requests and exceptions
+set on futures are thrown into the generator.
+The same steps can then be driven either by blocking requests calls
+or by asyncio coroutines.
+"""
+from __future__ import unicode_literals
+from concurrent.futures import Future
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlsplit
+import asyncio
+import time
+import typing
+import requests
+import requests.adapters
+import lyricstagger.shared as shared
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+Request = typing.NamedTuple("Request", [("url", str), ("params", dict)])
+Response = typing.NamedTuple("Response", [("status_code", int), ("text", str)])
+Call = typing.NamedTuple("Call", [("func", typing.Callable[..., typing.Any]),
+                                  ("args", tuple)])
+
+StepsType = typing.Generator[typing.Union[Request, Future, Call], typing.Any, typing.Any]
+
+
+class Stats(object):
+    """Thread-safe counters of requests made by helpers"""
+    def __init__(self):
+        self.counters = dict()  # type: typing.Dict[str, int]
+        self.lock = Lock()
+
+    def add(self, name: str, count: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def __getitem__(self, name: str) -> int:
+        with self.lock:
+            return self.counters.get(name, 0)
+
+
+STATS = Stats()
+
+
+def is_failure(status_code: int) -> bool:
+    """Website throttles us or fails under load,
+    answer tells nothing about lyrics being there"""
+    return status_code == 429 or status_code >= 500
+
+
+def _count_response(status_code: int) -> None:
+    STATS.add("requests")
+    if is_failure(status_code):
+        STATS.add("errors")
+
+
+def check_response(response: typing.Any) -> typing.Any:
+    """Raise HTTPError for failed response, so lookup counts
+    as failed instead of finding nothing"""
+    if is_failure(response.status_code):
+        raise requests.HTTPError("Got code %d" % response.status_code)
+    return response
+
+
+class Limiter(object):
+    """Token bucket limiting rate of requests to host,
+    with cap on number of concurrent requests"""
+    # how often coroutines check for free concurrent request slot
+    poll_interval = 0.01
+
+    def __init__(self, rate: float, max_concurrent: int):
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+        self.slots = BoundedSemaphore(max_concurrent)
+
+    def _reserve(self) -> float:
+        """Take token from bucket, return seconds to wait for it"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # tokens can go below zero, so waiting callers queue up
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self) -> None:
+        """Wait for free slot and token"""
+        self.slots.acquire()
+        time.sleep(self._reserve())
+
+    async def acquire_async(self) -> None:
+        """Wait for free slot and token without blocking event loop"""
+        while not self.slots.acquire(blocking=False):
+            await asyncio.sleep(self.poll_interval)
+        await asyncio.sleep(self._reserve())
+
+    def release(self) -> None:
+        """Free slot taken by acquire"""
+        self.slots.release()
+
+
+LIMITERS = dict()  # type: typing.Dict[str, Limiter]
+
+# connections kept alive to each host by default
+POOL_SIZE = 10
+
+# session shared by all helpers and threads
+SESSION = None  # type: requests.Session
+_session_lock = Lock()
+
+
+def set_limit(url: str, rate: float, max_concurrent: int) -> None:
+    """Limit requests to host of url to rate per second
+    and max_concurrent requests at once"""
+    LIMITERS[urlsplit(url).netloc] = Limiter(rate, max_concurrent)
+
+
+def get_limiter(url: str) -> Limiter:
+    """Get limiter for host of url, or None if host is not limited"""
+    return LIMITERS.get(urlsplit(url).netloc)
+
+
+def start_session(pool_size: int = POOL_SIZE) -> None:
+    """Start shared session keeping up to pool_size connections
+    to each host alive"""
+    global SESSION
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    with _session_lock:
+        old_session, SESSION = SESSION, session
+    if old_session is not None:
+        old_session.close()
+
+
+def stop_session() -> None:
+    """Close shared session, next request starts new one"""
+    global SESSION
+    with _session_lock:
+        old_session, SESSION = SESSION, None
+    if old_session is not None:
+        old_session.close()
+
+
+# opened by engines for their runs, engines share session
+# started by the first one whatever pool size they want
+SHARED_SESSION = shared.Shared("session", start_session, stop_session, strict=False)
+
+
+def get_session() -> requests.Session:
+    """Get shared session, starting it with default pool size if needed"""
+    with _session_lock:
+        if SESSION is not None:
+            return SESSION
+    start_session()
+    return SESSION
+
+
+def connections() -> int:
+    """Number of connections opened by shared session,
+    requests made by other ones reused them"""
+    session = SESSION
+    if session is None:
+        return 0
+    count = 0
+    # the same adapter is mounted for http and https
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                count += pool.num_connections
+    return count
+
+
+def summary() -> str:
+    """Describe requests made by helpers"""
+    return "Requests made: %d, failed: %d, connections opened: %d" % (
+        STATS["requests"], STATS["errors"], connections())
+
+
+def get(url: str, params: dict = None) -> requests.Response:
+    """Perform blocking GET request"""
+    limiter = get_limiter(url)
+    if limiter is None:
+        return _get(url, params)
+    limiter.acquire()
+    try:
+        return _get(url, params)
+    finally:
+        limiter.release()
+
+
+def _get(url: str, params: dict = None) -> requests.Response:
+    try:
+        result = get_session().get(url, params=params)
+    except requests.ConnectionError:
+        STATS.add("errors")
+        raise
+    _count_response(result.status_code)
+    return result
+
+
+def run(steps: StepsType) -> typing.Any:
+    """Drive request steps with blocking requests and return their result"""
+    try:
+        request = next(steps)
+        while True:
+            try:
+                if isinstance(request, Future):
+                    response = request.result()
+                elif isinstance(request, Call):
+                    response = request.func(*request.args)
+                else:
+                    response = check_response(get(request.url, request.params))
+            except Exception as error:
+                request = steps.throw(error)
+            else:
+                request = steps.send(response)
+    except StopIteration as stop:
+        return stop.value
+
+
+def async_session(limit: int = 100) -> typing.Any:
+    """Create aiohttp session to share between coroutines,
+    or return None if aiohttp is not installed"""
+    if aiohttp is None:
+        return None
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit))
+
+
+async def get_async(url: str, params: dict = None, session=None) -> Response:
+    """Perform GET request without blocking event loop"""
+    limiter = get_limiter(url)
+    if limiter is None:
+        return await _get_async(url, params, session)
+    await limiter.acquire_async()
+    try:
+        return await _get_async(url, params, session)
+    finally:
+        limiter.release()
+
+
+async def _get_async(url: str, params: dict = None, session=None) -> Response:
+    if aiohttp is None:
+        # no async http client, fall back to default executor
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(None, _get, url, params)
+        return Response(result.status_code, result.text)
+    try:
+        if session is None:
+            async with aiohttp.ClientSession() as own_session:
+                return await _get_async(url, params, own_session)
+        async with session.get(url, params=params) as result:
+            _count_response(result.status)
+            return Response(result.status, await result.text())
+    except aiohttp.ClientError as error:
+        STATS.add("errors")
+        # helpers callers handle requests exceptions only
+        raise requests.ConnectionError(error)
+
+
+async def run_async(steps: StepsType, session=None) -> typing.Any:
+    """Drive request steps with coroutines and return their result"""
+    try:
+        request = next(steps)
+        while True:
+            try:
+                if isinstance(request, Future):
+                    # future can be shared with other lookups waiting for it,
+                    # cancelled lookup must not cancel it for them
+                    response = await asyncio.shield(asyncio.wrap_future(request))
+                elif isinstance(request, Call):
+                    loop = asyncio.get_event_loop()
+                    response = await loop.run_in_executor(None, request.func,
+                                                          *request.args)
+                else:
+                    response = check_response(
+                        await get_async(request.url, request.params, session))
+            except Exception as error:
+                request = steps.throw(error)
+            else:
+                request = steps.send(response)
+    except StopIteration as stop:
+        return stop.value
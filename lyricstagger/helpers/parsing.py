@@ -0,0 +1,74 @@
+"""
+Parsing html outside of fetching threads.
+
+Parsing with BeautifulSoup is pure-Python and holds GIL, so with many
+fetching threads it can be moved to pool of processes: only raw html
+is sent to the pool, and only parsed result is sent back.
+Without the pool html is parsed by fetching threads, or by executor
+threads when lyrics are fetched by coroutines.
+
+Helpers build only the elements they look for (SoupStrainer),
+with lxml tree builder when it's installed.
+"""
+from __future__ import unicode_literals
+from concurrent.futures import ProcessPoolExecutor
+import typing
+from bs4 import BeautifulSoup, SoupStrainer
+import lyricstagger.log as log
+import lyricstagger.shared as shared
+from . import network
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+BACKENDS = ["lxml", "html.parser"]
+DEFAULT_BACKEND = "lxml" if lxml is not None else "html.parser"
+BACKEND = DEFAULT_BACKEND
+
+POOL = None
+
+
+def set_backend(backend: str) -> None:
+    """Select BeautifulSoup tree builder, html.parser is always available"""
+    global BACKEND
+    if backend == "lxml" and lxml is None:
+        log.warning("lxml is not installed, parsing with html.parser")
+        backend = "html.parser"
+    BACKEND = backend
+
+
+def make_soup(text: str, name: str, class_: str) -> BeautifulSoup:
+    """Parse only elements with given tag name and class from html"""
+    return BeautifulSoup(text, BACKEND, parse_only=SoupStrainer(name, class_=class_))
+
+
+def start(processes: int) -> None:
+    """Start pool of parsing processes"""
+    global POOL
+    stop()
+    POOL = ProcessPoolExecutor(max_workers=processes)
+
+
+def stop() -> None:
+    """Stop pool of parsing processes, parse in calling thread again"""
+    global POOL
+    if POOL is not None:
+        POOL.shutdown()
+        POOL = None
+
+
+# opened by engines for their runs, engines share pool
+# started by the first one whatever number of processes they want
+SHARED_POOL = shared.Shared("parsing pool", start, stop, strict=False)
+SHARED_BACKEND = shared.Shared("html parser", set_backend,
+                               lambda: set_backend(DEFAULT_BACKEND))
+
+
+def parse_steps(parser: typing.Callable[..., typing.Any],
+                *args) -> typing.Generator[typing.Any, typing.Any, typing.Any]:
+    """Step running parser in process pool if it's started,
+    return parser result"""
+    if POOL is None:
+        return (yield network.Call(parser, args))
+    return (yield POOL.submit(parser, *args))
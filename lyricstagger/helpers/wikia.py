@@ -3,14 +3,20 @@ Helper to download lyrics from lyrics.wikia.com
 """
 from __future__ import unicode_literals
 import re
-import requests
-from bs4 import BeautifulSoup, NavigableString, Tag, Comment
+from bs4 import NavigableString, Tag, Comment
+import lyricstagger.cache as cache
 import lyricstagger.log as log
+from . import network, parsing
 
 
 class Wikia(object):
     """Lyrics Downloader for lyrics.wikia.com"""
     url = "http://lyrics.wikia.com/api.php"
+    # name of website in cache of resolved pages
+    site = "wikia"
+    # requests per second and concurrent requests tolerated by website
+    rate = 10.0
+    max_concurrent = 8
 
     def __init__(self):
         pass
@@ -19,7 +25,7 @@ class Wikia(object):
     def parse(text: str, gracenote: bool) -> str:
         """Parse lyrics from html"""
         # parse the result
-        soup = BeautifulSoup(text, "html.parser")
+        soup = parsing.make_soup(text, "div", "lyricbox")
         lyricbox = soup.find('div', "lyricbox")
         if lyricbox is None:
             log.debug("BeautifulSoup failed to find 'lyricbox' div")
@@ -47,12 +53,20 @@ class Wikia(object):
         return lyrics.strip()
 
     @staticmethod
-    def get_raw_data(artist: str, song: str) -> [str, bool]:
-        """Download html with lyrics, return None or tuple (text, gracenote)"""
-        if not artist or not song:
-            return None  # wikia needs both informations
+    def is_gracenote(html_url: str) -> bool:
+        return '/Gracenote:' in html_url
+
+    @staticmethod
+    def gracenote_url(html_url: str) -> str:
+        """Url of Gracenote variant of page (e.g. Glen Hansard - High Hope)"""
+        return html_url[:9] + html_url[9:].replace('/', '/Gracenote:', 1)
+
+    @staticmethod
+    def page_url_steps(artist: str, song: str) -> network.StepsType:
+        """Request steps to ask api for song page url,
+        return url, empty string if song is missing, or None on failure"""
         payload = {'action': "lyrics", 'artist': artist, 'song': song, 'fmt': "json"}
-        result = requests.get(Wikia.url, params=payload)
+        result = yield network.Request(Wikia.url, payload)
         if result.status_code != 200:
             return None
 
@@ -62,30 +76,64 @@ class Wikia(object):
             return None
 
         html_url = match.group(1)
-        log.debug('fetch url %s', html_url)
         if 'action=edit' in html_url:
             log.debug("no lyrics found")
-            return None
+            return ""
+        return html_url
 
-        result = requests.get(html_url)
-        gracenote = False
+    @staticmethod
+    def raw_data_steps(artist: str, song: str) -> network.StepsType:
+        """Request steps to download html with lyrics,
+        return None or tuple (text, gracenote)"""
+        if not artist or not song:
+            return None  # wikia needs both informations
+        # page resolved by previous lookup, including Gracenote fallback
+        html_url = cache.lookup_page(Wikia.site, artist, song)
+        if html_url is cache.MISSING:
+            html_url = yield from Wikia.page_url_steps(artist, song)
+            if html_url == "":
+                cache.update_page(Wikia.site, artist, song, "")
+        if not html_url:
+            return None
 
-        if result.status_code != 200:
-            # try it also with Gracenote: (e.g. Glen Hansard - High Hope)
-            html_url = html_url[:9] + \
-                html_url[9:].replace('/', '/Gracenote:', 1)
+        log.debug('fetch url %s', html_url)
+        result = yield network.Request(html_url, None)
+        # song is missing only if the page api gave us is missing,
+        # other errors can go away
+        missing = result.status_code == 404
+        if result.status_code != 200 and not Wikia.is_gracenote(html_url):
+            html_url = Wikia.gracenote_url(html_url)
             log.debug('fetch url %s', html_url)
-            result = requests.get(html_url)
-            gracenote = True
-            if result.status_code != 200:
-                return None
-        return result.text, gracenote
+            result = yield network.Request(html_url, None)
+            missing = missing and result.status_code == 404
+        if result.status_code == 200:
+            cache.update_page(Wikia.site, artist, song, html_url)
+        elif missing:
+            cache.update_page(Wikia.site, artist, song, "")
+        if result.status_code != 200:
+            return None
+        return result.text, Wikia.is_gracenote(html_url)
 
     @staticmethod
-    def fetch(artist: str, song: str, _: str) -> str:
-        """Fetch lyrics from remote url"""
-        data = Wikia.get_raw_data(artist, song)
+    def get_raw_data(artist: str, song: str) -> [str, bool]:
+        """Download html with lyrics, return None or tuple (text, gracenote)"""
+        return network.run(Wikia.raw_data_steps(artist, song))
+
+    @staticmethod
+    def fetch_steps(artist: str, song: str, _: str) -> network.StepsType:
+        """Request steps to fetch lyrics, return lyrics or None"""
+        data = yield from Wikia.raw_data_steps(artist, song)
         if data:
             log.debug("Parsing lyrics for '{0}' - '{1}'".format(artist, song))
-            return Wikia.parse(data[0], data[1])
+            return (yield from parsing.parse_steps(Wikia.parse, data[0], data[1]))
         return None
+
+    @staticmethod
+    def fetch(artist: str, song: str, album: str) -> str:
+        """Fetch lyrics from remote url"""
+        return network.run(Wikia.fetch_steps(artist, song, album))
+
+    @staticmethod
+    async def fetch_async(artist: str, song: str, album: str, session=None) -> str:
+        """Fetch lyrics from remote url without blocking event loop"""
+        return await network.run_async(Wikia.fetch_steps(artist, song, album), session)
@@ -0,0 +1,80 @@
+"""
+Persistent index of tags in musical files
+
+Index remembers size and modification time of every processed file
+together with its tags and lyrics presence, so files not changed
+since previous run don't have to be opened again.
+Files are indexed by real path, so runs given relative or absolute path,
+or path through symlink, find the same files.
+"""
+import os
+import typing
+import lyricstagger.log as log
+import lyricstagger.store as store
+
+Entry = typing.NamedTuple("Entry", [("data", typing.Dict[str, str]),
+                                    ("lyrics", bool)])
+
+
+class Index(store.Store):
+    """Thread-safe index of files tags stored in SQLite database"""
+    batch = 500
+    schema = ["CREATE TABLE IF NOT EXISTS files ("
+              "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+              "artist TEXT, album TEXT, title TEXT, lyrics INTEGER)"]
+
+    def lookup(self, filepath: str) -> Entry:
+        """Get indexed tags for file, or None if file is new or modified"""
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        path = os.path.realpath(filepath)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT size, mtime, artist, album, title, lyrics "
+                "FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        data = None
+        if row[2] is not None:
+            data = dict(artist=row[2], album=row[3], title=row[4])
+        return Entry(data, bool(row[5]))
+
+    def update(self, filepath: str, data: typing.Dict[str, str],
+               lyrics: bool) -> None:
+        """Remember tags for file as it is on disk now"""
+        try:
+            stat = os.stat(filepath)
+        except OSError as error:
+            log.debug("Failed to index file: %s", error)
+            return
+        data = data or dict()
+        path = os.path.realpath(filepath)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, data.get("artist"),
+                 data.get("album"), data.get("title"), int(lyrics)))
+            self.updated()
+
+
+# opened by engines for their runs, actions open every file while it's closed
+SHARED = store.SharedStore("index", Index)
+start = SHARED.start
+stop = SHARED.stop
+
+
+def lookup(filepath: str) -> Entry:
+    """Get indexed tags for unchanged file, None if it should be opened"""
+    db = SHARED.store
+    if db is None:
+        return None
+    return db.lookup(filepath)
+
+
+def update(filepath: str, data: typing.Dict[str, str], lyrics: bool) -> None:
+    """Remember tags for file if index is open"""
+    db = SHARED.store
+    if db is not None:
+        db.update(filepath, data, lyrics)
@@ -2,6 +2,8 @@
 
 import logging
 import os
+import typing
+from threading import Lock
 import click
 # set up logging
 if 'DEBUG' in os.environ:
@@ -17,35 +19,70 @@ class CliLogger:
     def __init__(self):
         self.stats = dict()
         self.states = [
-            "processed", "written", "removed", "not_found", "not_saved"
+            "processed", "written", "removed", "not_found", "not_saved",
+            "unchanged", "in_place", "rewritten"
         ]
         for key in self.states:
             self.stats[key] = 0
+        self.lock = Lock()
+        # states logged for files being tracked, by file path
+        self.tracked = dict()
+
+    def track(self, filepath: str):
+        """Start recording states logged for file"""
+        with self.lock:
+            self.tracked[filepath] = []
+
+    def untrack(self, filepath: str) -> typing.List[str]:
+        """Stop recording states for file and return them"""
+        with self.lock:
+            return self.tracked.pop(filepath, [])
+
+    def _count(self, state: str, filepath: str):
+        with self.lock:
+            self.stats[state] += 1
+            if state != "processed" and filepath in self.tracked:
+                self.tracked[filepath].append(state)
 
     def log_processing(self, filepath: str):
         logging.debug("processing audio file '%s'",
                       click.format_filename(filepath))
-        self.stats["processed"] += 1
+        self._count("processed", filepath)
 
     def log_writing(self, filepath: str):
         logging.debug("writing LYRICS tag to file '%s'",
                       click.format_filename(filepath))
-        self.stats["written"] += 1
+        self._count("written", filepath)
 
     def log_removing(self, filepath: str):
         logging.debug("removing LYRICS tag from file '%s'",
                       click.format_filename(filepath))
-        self.stats["removed"] += 1
+        self._count("removed", filepath)
 
     def log_no_lyrics_saved(self, filepath: str):
         logging.debug("no lyrics saved for edited file '%s'",
                       click.format_filename(filepath))
-        self.stats["not_saved"] += 1
+        self._count("not_saved", filepath)
+
+    def log_unchanged(self, filepath: str):
+        logging.debug("lyrics tag is unchanged, not saving file '%s'",
+                      click.format_filename(filepath))
+        self._count("unchanged", filepath)
+
+    def log_saved(self, filepath: str, in_place: bool):
+        if in_place:
+            logging.debug("tags saved in place to file '%s'",
+                          click.format_filename(filepath))
+            self._count("in_place", filepath)
+        else:
+            logging.debug("whole file '%s' rewritten to save tags",
+                          click.format_filename(filepath))
+            self._count("rewritten", filepath)
 
     def log_not_found(self, filepath: str):
         logging.debug("no lyrics found for file '%s'",
                       click.format_filename(filepath))
-        self.stats["not_found"] += 1
+        self._count("not_found", filepath)
 
     def show_stats(self) -> str:
         report_tpl = "-----\n" \
@@ -53,13 +90,19 @@ class CliLogger:
             "Tags written: " + click.style("{written}", fg="green") + ", " \
             "Tags removed: " + click.style("{removed}", fg="yellow") + ",\n" \
             "Lyrics missing: " + click.style("{not_found}", fg="red") + ", " \
-            "Lyrics not saved: " + click.style("{not_saved}", fg="red")
+            "Lyrics not saved: " + click.style("{not_saved}", fg="red") + ",\n" \
+            "Files unchanged: " + click.style("{unchanged}", fg="blue") + ", " \
+            "saved in place: " + click.style("{in_place}", fg="green") + ", " \
+            "rewritten: " + click.style("{rewritten}", fg="yellow")
         report = report_tpl.format(
             processed=self.stats["processed"],
             written=self.stats["written"],
             removed=self.stats["removed"],
             not_found=self.stats["not_found"],
             not_saved=self.stats["not_saved"],
+            unchanged=self.stats["unchanged"],
+            in_place=self.stats["in_place"],
+            rewritten=self.stats["rewritten"],
         )
         return report
 
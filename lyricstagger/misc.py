@@ -3,49 +3,295 @@ Misc functions for lyrics_tagger
 """
 from __future__ import unicode_literals
 from __future__ import print_function
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from threading import Lock
+import asyncio
+import collections
 import os
+import json
+import time
 import typing
 import requests
 import mutagen
 from mutagen.id3 import USLT
 import click
+import lyricstagger.cache as cache
 import lyricstagger.log as log
+import lyricstagger.ranking as ranking
+import lyricstagger.shared as shared
 import lyricstagger.helpers as hlp
 
 SUPPORTED_FILES = ['.ogg', '.flac', '.mp3']
+SUPPORTED_EXTENSIONS = frozenset(SUPPORTED_FILES)
+# padding reserved when tags have to be rewritten anyway,
+# so lyrics added or edited later fit without rewriting whole file
+LYRICS_PADDING = 16 * 1024
 
 
-def fetch(artist: str, song: str, album: str) -> str:
-    """Fetch lyrics with different helpers"""
+# seconds to wait for helper before asking the next one at the same time,
+# None to ask helpers one after another, 0 to ask all of them at once
+HEDGE_DELAY = None  # type: float
+# threads running hedged lookups for all fetching threads
+HEDGE_THREADS = 64
+# ask only helpers not using network
+OFFLINE = False
+
+
+def _set_hedge_delay(delay: float) -> None:
+    global HEDGE_DELAY
+    HEDGE_DELAY = delay
+
+
+def _set_offline(offline: bool) -> None:
+    global OFFLINE
+    OFFLINE = offline
+
+
+# set by engines for their runs
+SHARED_HEDGE_DELAY = shared.Shared("hedge delay", _set_hedge_delay,
+                                   lambda: _set_hedge_delay(None))
+SHARED_OFFLINE = shared.Shared("offline mode", _set_offline,
+                               lambda: _set_offline(False))
+
+_hedge_pool = None  # type: ThreadPoolExecutor
+_hedge_lock = Lock()
+
+
+def _hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_pool
+    with _hedge_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_THREADS)
+        return _hedge_pool
+
+
+def _helpers(artist: str) -> typing.List[typing.Any]:
+    """Helpers in order to ask them for artist lyrics"""
     helpers = hlp.HELPERS
+    if OFFLINE:
+        helpers = [helper for helper in helpers if helper.url is None]
+    return ranking.order(helpers, artist)
+
+
+def _fetch_helper(helper: typing.Any, artist: str, song: str,
+                  album: str) -> typing.Tuple[str, bool]:
+    """Fetch lyrics with one helper, return lyrics and True
+    if it failed to connect or website throttled or failed us"""
+    started = time.monotonic()
+    try:
+        lyrics = helper.fetch(artist, song, album)
+    except (requests.ConnectionError, requests.HTTPError) as error:
+        log.warning('Request failed: %s', error)
+        ranking.record(helper, artist, False, time.monotonic() - started)
+        return None, True
+    ranking.record(helper, artist, bool(lyrics), time.monotonic() - started)
+    return lyrics, False
+
+
+async def _fetch_helper_async(helper: typing.Any, artist: str, song: str,
+                              album: str, session=None) -> typing.Tuple[str, bool]:
+    started = time.monotonic()
+    try:
+        lyrics = await helper.fetch_async(artist, song, album, session)
+    except (requests.ConnectionError, requests.HTTPError) as error:
+        log.warning('Request failed: %s', error)
+        ranking.record(helper, artist, False, time.monotonic() - started)
+        return None, True
+    ranking.record(helper, artist, bool(lyrics), time.monotonic() - started)
+    return lyrics, False
+
+
+def _fetch_hedged(helpers: typing.List[typing.Any], artist: str, song: str,
+                  album: str) -> typing.Tuple[str, bool]:
+    """Start next helper if current one didn't answer in HEDGE_DELAY seconds,
+    return first lyrics in helpers order and True if some helper failed"""
+    executor = _hedge_executor()
+    waiting = collections.deque(helpers)
+    futures = []  # type: typing.List[Future]
     lyrics = None
-    for helper in helpers:
-        try:
-            lyrics = helper.fetch(artist, song, album)
-        except requests.ConnectionError as error:
-            log.warning('Connection error: %s', error)
+    failed = False
+    for index in range(len(waiting)):
+        if index == len(futures):
+            futures.append(executor.submit(_fetch_helper, waiting.popleft(),
+                                           artist, song, album))
+        while waiting and not wait([futures[index]], timeout=HEDGE_DELAY).done:
+            futures.append(executor.submit(_fetch_helper, waiting.popleft(),
+                                           artist, song, album))
+        lyrics, helper_failed = futures[index].result()
+        failed = failed or helper_failed
         if lyrics:
             break
+    # results of slower helpers are ignored, not started ones are cancelled
+    for future in futures:
+        future.cancel()
+    return lyrics, failed
+
+
+async def _fetch_hedged_async(helpers: typing.List[typing.Any], artist: str,
+                              song: str, album: str,
+                              session=None) -> typing.Tuple[str, bool]:
+    waiting = collections.deque(helpers)
+    tasks = []  # type: typing.List[asyncio.Future]
+    lyrics = None
+    failed = False
+    for index in range(len(waiting)):
+        if index == len(tasks):
+            tasks.append(asyncio.ensure_future(_fetch_helper_async(
+                waiting.popleft(), artist, song, album, session)))
+        while waiting:
+            done, _ = await asyncio.wait([tasks[index]], timeout=HEDGE_DELAY)
+            if done:
+                break
+            tasks.append(asyncio.ensure_future(_fetch_helper_async(
+                waiting.popleft(), artist, song, album, session)))
+        lyrics, helper_failed = await tasks[index]
+        failed = failed or helper_failed
+        if lyrics:
+            break
+    for task in tasks:
+        task.cancel()
+    return lyrics, failed
+
+
+def _remember(helpers: typing.List[typing.Any], artist: str, song: str,
+              album: str, lyrics: str, failed: bool) -> None:
+    """Cache lookup result"""
+    if lyrics:
+        cache.update(artist, song, album, lyrics)
+    # miss is remembered only if all websites answered they don't have lyrics,
+    # not when some helper couldn't answer or websites weren't asked (offline)
+    elif not failed and any(helper.url is not None for helper in helpers):
+        cache.update(artist, song, album, lyrics)
+
+
+def fetch(artist: str, song: str, album: str) -> str:
+    """Fetch lyrics with different helpers"""
+    lyrics = cache.lookup(artist, song, album)
+    if lyrics is not cache.MISSING:
+        return lyrics
+    helpers = _helpers(artist)
+    if HEDGE_DELAY is not None:
+        lyrics, failed = _fetch_hedged(helpers, artist, song, album)
+    else:
+        lyrics, failed = None, False
+        for helper in helpers:
+            lyrics, helper_failed = _fetch_helper(helper, artist, song, album)
+            failed = failed or helper_failed
+            if lyrics:
+                break
+    _remember(helpers, artist, song, album, lyrics, failed)
+    return lyrics
+
+
+async def fetch_async(artist: str, song: str, album: str, session=None) -> str:
+    """Fetch lyrics with different helpers without blocking event loop"""
+    lyrics = cache.lookup(artist, song, album)
+    if lyrics is not cache.MISSING:
+        return lyrics
+    helpers = _helpers(artist)
+    if HEDGE_DELAY is not None:
+        lyrics, failed = await _fetch_hedged_async(helpers, artist, song,
+                                                   album, session)
+    else:
+        lyrics, failed = None, False
+        for helper in helpers:
+            lyrics, helper_failed = await _fetch_helper_async(
+                helper, artist, song, album, session)
+            failed = failed or helper_failed
+            if lyrics:
+                break
+    _remember(helpers, artist, song, album, lyrics, failed)
     return lyrics
 
 
-def get_file_list(path_list: typing.Iterable[str]) -> typing.Iterator[str]:
+def _scan_dir(path: str) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    """List supported files and subdirectories in directory"""
+    files, dirs = [], []
+    try:
+        for entry in os.scandir(path):
+            if entry.is_dir():
+                # don't follow symlinks to directories, like os.walk
+                if not entry.is_symlink():
+                    dirs.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS:
+                files.append(entry.path)
+    except OSError as error:
+        log.debug("Failed to list directory: %s", error)
+    return files, dirs
+
+
+def walk(path: str, threads: int = 8) -> typing.Iterator[str]:
+    """Generator of supported file pathes in directory tree,
+    listing up to `threads` directories at once"""
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = {executor.submit(_scan_dir, path)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                for each in dirs:
+                    pending.add(executor.submit(_scan_dir, each))
+                for filepath in files:
+                    yield filepath
+
+
+def get_file_list(path_list: typing.Iterable[str],
+                  threads: int = 8) -> typing.Iterator[str]:
     """Generator of file pathes in directory"""
     for path in path_list:
         if os.path.exists(path):
             if os.path.isdir(path):
-                for root, _, files in os.walk(path):
-                    for each in files:
-                        _, ext = os.path.splitext(each)
-                        if ext.lower() in SUPPORTED_FILES:
-                            filepath = os.path.join(root, each)
-                            yield filepath
+                yield from walk(path, threads)
             else:
                 yield path
         else:
             log.warning("No such file or directory: %s" % path)
 
 
+def get_cache_dir() -> str:
+    """Get directory for files persisted between runs"""
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+                                os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "lyricstagger")
+
+
+def _file_count_key(path_list: typing.Iterable[str]) -> str:
+    return "\n".join(sorted(os.path.abspath(path) for path in path_list))
+
+
+def load_file_count(counts_file: str, path_list: typing.Iterable[str]) -> int:
+    """Get number of files found in path_list during previous run"""
+    try:
+        with open(counts_file) as counts:
+            return int(json.load(counts).get(_file_count_key(path_list), 0))
+    except (OSError, ValueError, AttributeError) as error:
+        log.debug("Failed to load file count: %s", error)
+        return 0
+
+
+def save_file_count(counts_file: str, path_list: typing.Iterable[str],
+                    count: int) -> None:
+    """Remember number of files found in path_list for next runs"""
+    try:
+        with open(counts_file) as counts:
+            data = json.load(counts)
+    except (OSError, ValueError):
+        data = None
+    if not isinstance(data, dict):
+        data = dict()
+    data[_file_count_key(path_list)] = count
+    try:
+        os.makedirs(os.path.dirname(counts_file), exist_ok=True)
+        # write to temporary file first, so concurrent runs can't see
+        # half-written file
+        tmp_file = "%s.%d" % (counts_file, os.getpid())
+        with open(tmp_file, "w") as counts:
+            json.dump(data, counts)
+        os.replace(tmp_file, counts_file)
+    except OSError as error:
+        log.warning("Failed to save file count: %s", error)
+
+
 def get_tags(audio: mutagen.File) -> typing.Dict[str, str]:
     """Get tags from audio class"""
     if not audio:
@@ -53,7 +299,10 @@ def get_tags(audio: mutagen.File) -> typing.Dict[str, str]:
     data = dict()
     if "audio/mp3" in audio.mime:
         tag_map = {"artist": "TPE1", "album": "TALB", "title": "TIT2"}
-        lyrics_tags = ["USLT:None:eng", "USLT:None:'eng'"]
+        # lyrics we write first, then lyrics with any description
+        # and language, like has_lyrics and probe count them
+        lyrics_tags = ["USLT:None:eng", "USLT:None:'eng'"] + sorted(
+            key for key in audio.keys() if key.startswith("USLT"))
 
         def getter(x):
             return x.text
@@ -84,20 +333,29 @@ def get_tags(audio: mutagen.File) -> typing.Dict[str, str]:
     return data
 
 
+def has_lyrics(audio: mutagen.File) -> bool:
+    """Check if audio has any lyrics tag, even without other tags"""
+    if not audio:
+        return False
+    if "audio/mp3" in audio.mime:
+        return any(key.startswith("USLT") for key in audio.keys())
+    return "lyrics" in audio
+
+
 def get_audio(file_path: str) -> mutagen.File:
     """Get audio object from file"""
     return mutagen.File(file_path)
 
 
-def remove_lyrics(audio: mutagen.File) -> None:
-    """Remove lyrics tag from audio"""
+def remove_lyrics(audio: mutagen.File) -> bool:
+    """Remove lyrics tag from audio, return False if there was none"""
+    if not has_lyrics(audio):
+        return False
     if "audio/mp3" in audio.mime:
         audio.tags.delall("USLT")
     else:
-        try:
-            del audio["lyrics"]
-        except KeyError:
-            pass
+        del audio["lyrics"]
+    return True
 
 
 def edit_lyrics(audio: mutagen.File) -> str:
@@ -111,6 +369,30 @@ def edit_lyrics(audio: mutagen.File) -> str:
         return lyrics
 
 
+def same_lyrics(audio: mutagen.File, lyrics: str) -> bool:
+    """Check if write_lyrics would leave audio as it is"""
+    if "audio/mp3" in audio.mime:
+        return ("USLT:None:eng" in audio and
+                audio["USLT:None:eng"].text == lyrics)
+    return audio.get("lyrics") in ([lyrics], lyrics)
+
+
+def save_audio(audio: mutagen.File) -> bool:
+    """Save audio keeping existing padding if tags fit into it,
+    return False if whole file had to be rewritten"""
+    in_place = []
+
+    def padding(info) -> int:
+        in_place.append(info.padding >= 0)
+        if info.padding >= 0:
+            # don't let mutagen shrink padding, it's a rewrite too
+            return info.padding
+        return max(LYRICS_PADDING, info.get_default_padding())
+
+    audio.save(padding=padding)
+    return all(in_place)
+
+
 def write_lyrics(audio: mutagen.File, lyrics: str) -> mutagen.File:
     """Write lyrics to audio object"""
     if "audio/mp3" in audio.mime:
@@ -0,0 +1,208 @@
+"""
+Fast probe of tags in musical files
+
+Reads only tag headers (ID3v2 frames, Vorbis comment packet, FLAC metadata
+blocks), seeking over frames we don't need like embedded pictures,
+to tell if file has tags to look lyrics up by and if it has lyrics already.
+Files it can't handle are left to mutagen.
+"""
+import struct
+import typing
+import lyricstagger.index as index
+import lyricstagger.log as log
+
+# we don't read more than that, files with bigger comments go to mutagen
+MAX_READ = 1024 * 1024
+
+ID3_TAGS = {"TPE1": "artist", "TALB": "album", "TIT2": "title"}
+ID3_LYRICS = "USLT"
+ID3_ENCODINGS = ["latin-1", "utf-16", "utf-16-be", "utf-8"]
+# frames with these flags can't be read as is (compression, encryption...)
+ID3_FLAGS = {3: 0x00e0, 4: 0x004f}
+VORBIS_TAGS = ["artist", "album", "title"]
+VORBIS_LYRICS = "lyrics"
+
+_U32 = struct.Struct("<I")
+
+
+class ProbeError(Exception):
+    """File can't be probed and should be opened by mutagen"""
+
+
+def _read(fileobj: typing.BinaryIO, size: int) -> bytes:
+    if size > MAX_READ:
+        raise ProbeError("Header is too big")
+    data = fileobj.read(size)
+    if len(data) < size:
+        raise ProbeError("Unexpected end of file")
+    return data
+
+
+def _syncsafe(data: bytes) -> int:
+    size = 0
+    for byte in data:
+        size = (size << 7) | (byte & 0x7f)
+    return size
+
+
+def _entry(tags: typing.Dict[str, str], lyrics: bool) -> index.Entry:
+    """Make entry with data only if all tags are present, like misc.get_tags"""
+    for name in VORBIS_TAGS:
+        if name not in tags:
+            log.warning("Failed to find tag %s", name)
+            return index.Entry(None, lyrics)
+    return index.Entry(tags, lyrics)
+
+
+def _id3_text(data: bytes) -> str:
+    if not data or data[0] >= len(ID3_ENCODINGS):
+        raise ProbeError("Unknown text encoding")
+    text = data[1:].decode(ID3_ENCODINGS[data[0]], "replace")
+    # multiple values are separated by null, take the first one
+    return text.split("\x00")[0]
+
+
+def probe_id3(fileobj: typing.BinaryIO) -> index.Entry:
+    """Probe ID3v2.3 or ID3v2.4 tag"""
+    header = fileobj.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        # mutagen can find ID3v1 tag at the end of file
+        raise ProbeError("No ID3v2 header")
+    version, flags = header[3], header[5]
+    if version not in ID3_FLAGS:
+        raise ProbeError("Unsupported ID3 version")
+    if flags & 0x80:
+        raise ProbeError("Unsynchronised tag")
+    end = 10 + _syncsafe(header[6:10])
+    if flags & 0x40:
+        size = fileobj.read(4)
+        if version == 4:
+            fileobj.seek(_syncsafe(size) - 4, 1)
+        else:
+            fileobj.seek(struct.unpack(">I", size)[0], 1)
+    tags = dict()
+    lyrics = False
+    while fileobj.tell() + 10 <= end:
+        frame = fileobj.read(10)
+        if len(frame) < 10 or frame[0] == 0:
+            # padding
+            break
+        frame_id = frame[:4].decode("latin-1")
+        if version == 4:
+            size = _syncsafe(frame[4:8])
+        else:
+            size = struct.unpack(">I", frame[4:8])[0]
+        if frame_id == ID3_LYRICS:
+            lyrics = True
+        elif frame_id in ID3_TAGS and ID3_TAGS[frame_id] not in tags:
+            if struct.unpack(">H", frame[8:10])[0] & ID3_FLAGS[version]:
+                raise ProbeError("Unsupported frame flags")
+            tags[ID3_TAGS[frame_id]] = _id3_text(_read(fileobj, size))
+            continue
+        fileobj.seek(size, 1)
+    if len(tags) < len(ID3_TAGS):
+        # mutagen takes missing frames from ID3v1 tag at the end of file
+        raise ProbeError("Tags can be in ID3v1 tag")
+    return _entry(tags, lyrics)
+
+
+def _vorbis_comments(data: bytes) -> index.Entry:
+    """Parse Vorbis comments without packet type and framing bit"""
+    try:
+        offset = 4 + _U32.unpack_from(data, 0)[0]
+        count = _U32.unpack_from(data, offset)[0]
+        offset += 4
+        tags = dict()
+        lyrics = False
+        for _ in range(count):
+            length = _U32.unpack_from(data, offset)[0]
+            offset += 4
+            comment = data[offset:offset + length].decode("utf-8", "replace")
+            offset += length
+            key, _, value = comment.partition("=")
+            key = key.lower()
+            if key == VORBIS_LYRICS:
+                lyrics = True
+            elif key in VORBIS_TAGS and key not in tags:
+                tags[key] = value
+    except struct.error:
+        raise ProbeError("Broken comments")
+    return _entry(tags, lyrics)
+
+
+def probe_flac(fileobj: typing.BinaryIO) -> index.Entry:
+    """Probe Vorbis comment block of FLAC file"""
+    if fileobj.read(4) != b"fLaC":
+        raise ProbeError("No FLAC header")
+    while True:
+        header = fileobj.read(4)
+        if len(header) < 4:
+            raise ProbeError("Unexpected end of file")
+        size = struct.unpack(">I", b"\x00" + header[1:])[0]
+        if header[0] & 0x7f == 4:
+            return _vorbis_comments(_read(fileobj, size))
+        if header[0] & 0x80:
+            # last block
+            return index.Entry(None, False)
+        fileobj.seek(size, 1)
+
+
+def _ogg_packets(fileobj: typing.BinaryIO) -> typing.Iterator[bytes]:
+    """Generator of packets from first logical stream of Ogg file"""
+    packet = b""
+    serial = None
+    while True:
+        header = fileobj.read(27)
+        if len(header) < 27 or header[:4] != b"OggS":
+            raise ProbeError("Broken Ogg page")
+        page_serial = header[14:18]
+        segments = _read(fileobj, header[26])
+        body = _read(fileobj, sum(segments))
+        if serial is None:
+            serial = page_serial
+        elif page_serial != serial:
+            continue
+        offset = 0
+        for length in segments:
+            packet += body[offset:offset + length]
+            offset += length
+            if len(packet) > MAX_READ:
+                raise ProbeError("Header is too big")
+            if length < 255:
+                yield packet
+                packet = b""
+
+
+def probe_ogg(fileobj: typing.BinaryIO) -> index.Entry:
+    """Probe comment header of Ogg Vorbis or Opus file"""
+    packets = _ogg_packets(fileobj)
+    next(packets)
+    comments = next(packets)
+    if comments.startswith(b"\x03vorbis"):
+        return _vorbis_comments(comments[7:])
+    if comments.startswith(b"OpusTags"):
+        return _vorbis_comments(comments[8:])
+    raise ProbeError("Unsupported Ogg codec")
+
+
+PROBES = {
+    ".mp3": probe_id3,
+    ".flac": probe_flac,
+    ".ogg": probe_ogg,
+}
+
+
+def probe(filepath: str) -> index.Entry:
+    """Get tags and lyrics presence reading only tags header,
+    or None if file should be opened by mutagen"""
+    for extension, probe_func in PROBES.items():
+        if filepath.lower().endswith(extension):
+            break
+    else:
+        return None
+    try:
+        with open(filepath, "rb") as fileobj:
+            return probe_func(fileobj)
+    except (ProbeError, OSError) as error:
+        log.debug("Failed to probe '%s': %s", filepath, error)
+        return None
@@ -0,0 +1,139 @@
+"""
+Helpers ordering by observed hit rate and latency
+
+Every lookup made by helper is recorded, overall and for the artist
+it was made for. Helpers are tried in the order of expected time to find
+lyrics (average latency divided by hit rate), artist statistics are used
+once there are enough lookups for the artist, so libraries where one
+website knows most of the music ask it first.
+Helpers not using network, like local database, are always asked first.
+Statistics are kept in JSON file between runs.
+"""
+from threading import Lock
+import json
+import os
+import typing
+import lyricstagger.log as log
+import lyricstagger.shared as shared
+
+# lookups of artist needed before its own statistics are used
+MIN_ARTIST_LOOKUPS = 3
+# latency in seconds assumed for helpers without lookups
+DEFAULT_LATENCY = 1.0
+
+# [lookups, hits, seconds spent] by helper name
+StatsType = typing.Dict[str, typing.List[float]]
+
+
+def helper_name(helper: typing.Any) -> str:
+    return type(helper).__name__
+
+
+def artist_key(artist: str) -> str:
+    return " ".join((artist or "").split()).lower()
+
+
+def expected_time(stats: typing.List[float]) -> float:
+    """Expected seconds spent on lookups by helper until it finds lyrics"""
+    lookups, hits, seconds = stats
+    # smoothed, so few lookups don't push helper to the end forever
+    hit_rate = (hits + 1.0) / (lookups + 2.0)
+    latency = (seconds + DEFAULT_LATENCY) / (lookups + 1.0)
+    return latency / hit_rate
+
+
+class Ranking(object):
+    """Thread-safe helpers statistics stored in JSON file"""
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = Lock()
+        self.helpers = dict()  # type: StatsType
+        # helpers statistics by normalized artist name
+        self.artists = dict()  # type: typing.Dict[str, StatsType]
+        try:
+            with open(path) as stats_file:
+                data = json.load(stats_file)
+            self.helpers = dict(data["helpers"])
+            self.artists = dict(data["artists"])
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            log.debug("Failed to load helpers statistics: %s", error)
+
+    def record(self, helper: typing.Any, artist: str, found: bool,
+               elapsed: float) -> None:
+        """Remember result of helper lookup"""
+        name = helper_name(helper)
+        with self.lock:
+            for stats in (self.helpers,
+                          self.artists.setdefault(artist_key(artist), dict())):
+                entry = stats.setdefault(name, [0, 0, 0.0])
+                entry[0] += 1
+                entry[1] += int(found)
+                entry[2] += elapsed
+
+    def order(self, helpers: typing.List[typing.Any],
+              artist: str) -> typing.List[typing.Any]:
+        """Get helpers sorted by expected time to find artist lyrics,
+        helpers not using network stay first in their order"""
+        local = [helper for helper in helpers if helper.url is None]
+        helpers = [helper for helper in helpers if helper.url is not None]
+        with self.lock:
+            stats = self.helpers
+            artist_stats = self.artists.get(artist_key(artist), dict())
+            if all(artist_stats.get(helper_name(helper), [0])[0] >= MIN_ARTIST_LOOKUPS
+                   for helper in helpers):
+                stats = artist_stats
+            times = [expected_time(stats.get(helper_name(helper), [0, 0, 0.0]))
+                     for helper in helpers]
+        # sort is stable, helpers without difference keep their order
+        return local + [helpers[i] for i in sorted(range(len(helpers)),
+                                                   key=times.__getitem__)]
+
+    def save(self) -> None:
+        with self.lock:
+            data = dict(helpers=self.helpers, artists=self.artists)
+            try:
+                dirname = os.path.dirname(self.path)
+                if dirname:
+                    os.makedirs(dirname, exist_ok=True)
+                # concurrent runs can't see half-written file
+                tmp_file = "%s.%d" % (self.path, os.getpid())
+                with open(tmp_file, "w") as stats_file:
+                    json.dump(data, stats_file)
+                os.replace(tmp_file, self.path)
+            except OSError as error:
+                log.warning("Failed to save helpers statistics: %s", error)
+
+
+RANKING = None
+
+
+def start(path: str) -> None:
+    """Load statistics and order helpers by them"""
+    global RANKING
+    stop()
+    RANKING = Ranking(path)
+
+
+def stop() -> None:
+    """Save statistics, helpers are used in fixed order again"""
+    global RANKING
+    if RANKING is not None:
+        RANKING.save()
+        RANKING = None
+
+
+# opened by engines for their runs
+SHARED = shared.Shared("helpers statistics", start, stop)
+
+
+def order(helpers: typing.List[typing.Any], artist: str) -> typing.List[typing.Any]:
+    """Get helpers in order to try them for artist"""
+    if RANKING is None:
+        return helpers
+    return RANKING.order(helpers, artist)
+
+
+def record(helper: typing.Any, artist: str, found: bool, elapsed: float) -> None:
+    """Remember helper lookup result if ranking is enabled"""
+    if RANKING is not None:
+        RANKING.record(helper, artist, found, elapsed)
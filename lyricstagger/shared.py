@@ -0,0 +1,51 @@
+"""
+Process-wide resources shared by engines
+
+Index, caches, sessions and settings used by lookups are module globals,
+so actions and helpers reach them without passing them around.
+Engines acquire them on start and release them on close: resource is opened
+by the first engine and closed by the last one, so closing one engine
+doesn't close it under other engines still running.
+"""
+from threading import Lock
+import typing
+
+
+class Shared(object):
+    """Resource opened with parameter by first acquire
+    and closed by last release
+
+    Strict resource (like database file or setting) can't be acquired with
+    other parameter while it's in use, as lookups of engines using it would
+    silently go to other file. Other resources (like connection pool size)
+    are shared as they were opened by the first engine."""
+    def __init__(self, name: str, open_func: typing.Callable[[typing.Any], None],
+                 close_func: typing.Callable[[], None], strict: bool = True):
+        self.name = name
+        self.open_func = open_func
+        self.close_func = close_func
+        self.strict = strict
+        self.lock = Lock()
+        self.key = None  # type: typing.Any
+        self.users = 0
+
+    def acquire(self, key: typing.Any) -> None:
+        """Open resource with key, or start using already opened one"""
+        with self.lock:
+            if self.users and self.strict and key != self.key:
+                raise ValueError("%s is already used with %r by other engine, "
+                                 "can't use it with %r" % (self.name, self.key, key))
+            if not self.users:
+                self.open_func(key)
+                self.key = key
+            self.users += 1
+
+    def release(self) -> None:
+        """Stop using resource, close it if nobody else uses it"""
+        with self.lock:
+            if not self.users:
+                return
+            self.users -= 1
+            if not self.users:
+                self.close_func()
+                self.key = None
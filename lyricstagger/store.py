@@ -0,0 +1,69 @@
+"""
+SQLite files kept between runs
+
+Index, lyrics cache and local lyrics database are SQLite files used by
+all threads of engines through one connection, with updates committed
+in batches. Each of them is a module global opened by engines for their
+runs, lookups and updates do nothing while it's closed.
+"""
+from threading import Lock
+import os
+import sqlite3
+import typing
+import lyricstagger.shared as shared
+
+
+class Store(object):
+    """Thread-safe SQLite database committing updates in batches"""
+    # number of updates to batch into one transaction
+    batch = 100
+    # statements creating tables if they don't exist
+    schema = []  # type: typing.List[str]
+
+    def __init__(self, path: str):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.lock = Lock()
+        self.pending = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.schema:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def updated(self) -> None:
+        """Count update made with lock held, commit once batch is full"""
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.commit()
+
+    def commit(self) -> None:
+        """Commit updates, with lock held"""
+        self.db.commit()
+        self.pending = 0
+
+    def close(self) -> None:
+        with self.lock:
+            self.commit()
+            self.db.close()
+
+
+class SharedStore(shared.Shared):
+    """Store opened with file path by first engine and closed by last one"""
+    def __init__(self, name: str, store_class: typing.Callable[[str], Store]):
+        shared.Shared.__init__(self, name, self.start, self.stop)
+        self.store_class = store_class
+        self.store = None  # type: Store
+
+    def start(self, path: str) -> None:
+        """Open store, closing one opened before"""
+        self.stop()
+        self.store = self.store_class(path)
+
+    def stop(self) -> None:
+        """Close store if it's open"""
+        if self.store is not None:
+            self.store.close()
+            self.store = None
@@ -0,0 +1,182 @@
+"""
+Watching directories for new and changed musical files
+
+Uses Linux inotify through ctypes, so no extra dependency is needed.
+Files are reported only when they were not modified for `delay` seconds,
+so files still being copied or written are not processed half-done.
+"""
+from threading import Event
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+import typing
+import lyricstagger.log as log
+import lyricstagger.misc as misc
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event without name: wd, mask, cookie, len
+EVENT = struct.Struct("iIII")
+
+
+class Inotify(object):
+    """Inotify instance watching directory trees"""
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not supported")
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        # watched directories by watch descriptor
+        self.dirs = dict()  # type: typing.Dict[int, str]
+
+    def add(self, path: str) -> None:
+        """Watch directory, not its subdirectories"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            log.warning("Failed to watch %s: %s", path,
+                        os.strerror(ctypes.get_errno()))
+        else:
+            self.dirs[wd] = path
+
+    def add_tree(self, path: str) -> None:
+        """Watch directory with all its subdirectories"""
+        self.add(path)
+        for dirpath, dirnames, _ in os.walk(path):
+            for dirname in dirnames:
+                self.add(os.path.join(dirpath, dirname))
+
+    def read(self, timeout: float) -> typing.List[typing.Tuple[str, int]]:
+        """Wait up to timeout seconds for events,
+        return list of their pathes and masks"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_IGNORED:
+                # directory was removed
+                self.dirs.pop(wd, None)
+                continue
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+                continue
+            path = self.dirs.get(wd)
+            if path is not None:
+                events.append((os.path.join(path, os.fsdecode(name)), mask))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class Debouncer(object):
+    """Pathes which were not touched for delay seconds"""
+    def __init__(self, delay: float):
+        self.delay = delay
+        # time of last change by path
+        self.pending = dict()  # type: typing.Dict[str, float]
+
+    def touch(self, path: str, now: float) -> None:
+        self.pending[path] = now
+
+    def ready(self, now: float) -> typing.List[str]:
+        """Get and forget pathes not touched for delay seconds"""
+        ready = [path for path, touched in self.pending.items()
+                 if now - touched >= self.delay]
+        for path in ready:
+            del self.pending[path]
+        return ready
+
+    def timeout(self, now: float) -> float:
+        """Seconds until next path gets ready, None if nothing is pending"""
+        if not self.pending:
+            return None
+        return max(0, min(self.pending.values()) + self.delay - now)
+
+
+class Watcher(object):
+    """Watch path_list for new and changed supported files"""
+    # how often watching checks if it was stopped
+    poll_interval = 1.0
+
+    def __init__(self, path_list: typing.Iterable[str], delay: float = 2.0):
+        self.path_list = list(path_list)
+        self.debouncer = Debouncer(delay)
+        self.stopped = Event()
+        self.inotify = Inotify()
+        for path in self.path_list:
+            if os.path.isdir(path):
+                self.inotify.add_tree(path)
+            else:
+                log.warning("Not a directory, can't watch: %s", path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _touch_tree(self, path: str, now: float) -> None:
+        for filepath in misc.get_file_list([path]):
+            self.debouncer.touch(filepath, now)
+
+    def _handle(self, path: str, mask: int, now: float) -> None:
+        if path is None:
+            # kernel dropped events, we have to look at everything
+            log.warning("Too many changes, rescanning watched directories")
+            for each in self.path_list:
+                self._touch_tree(each, now)
+        elif mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # files could appear in directory before we started to watch it
+                self.inotify.add_tree(path)
+                self._touch_tree(path, now)
+        elif os.path.splitext(path)[1].lower() in misc.SUPPORTED_EXTENSIONS:
+            self.debouncer.touch(path, now)
+
+    def batches(self) -> typing.Iterator[typing.List[str]]:
+        """Generator of lists of files which stopped changing,
+        runs until watcher is stopped"""
+        while not self.stopped.is_set():
+            timeout = self.debouncer.timeout(time.monotonic())
+            if timeout is None or timeout > self.poll_interval:
+                timeout = self.poll_interval
+            events = self.inotify.read(timeout)
+            now = time.monotonic()
+            for path, mask in events:
+                self._handle(path, mask, now)
+            ready = [path for path in self.debouncer.ready(now)
+                     if os.path.isfile(path)]
+            if ready:
+                yield sorted(ready)
+
+    def stop(self) -> None:
+        """Make batches return, can be called from other thread"""
+        self.stopped.set()
+
+    def close(self) -> None:
+        self.stop()
+        self.inotify.close()
@@ -39,8 +39,6 @@ setup(
         'License :: OSI Approved :: MIT License',
 
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
     ],
 
@@ -49,14 +47,18 @@ setup(
 
     packages=find_packages(),
 
+    # async def and os.scandir
+    python_requires='>=3.5',
+
     install_requires=['mutagen', 'requests', 'click', 'beautifulsoup4'],
 
     # You can install these using the following syntax, for example:
     # $ pip install -e .[dev,test]
     extras_require={
-        ':python_version<"3.5"': ['typing'],
         'dev': ['pylint'],
         'test': ['mock'],
+        'async': ['aiohttp'],
+        'fast': ['lxml'],
     },
 
     # To provide executable scripts, use entry points in preference to the
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 from __future__ import print_function
 import re
+import struct
 from mutagen import id3
 
 
@@ -13,6 +14,12 @@ class MockResponse:
         self.text = text
 
 
+class FakeSession:
+    """Mock requests.Session class calling given get function"""
+    def __init__(self, get):
+        self.get = get
+
+
 class FakeFile(dict):
     """Emulate musical file"""
 
@@ -32,7 +39,7 @@ class FakeFile(dict):
                 self["lyrics"] = lyrics
         self.mime = [mime]
 
-    def save(self):
+    def save(self, padding=None):
         pass
 
 
@@ -49,6 +56,15 @@ class BrokenFile(dict):
 # pylint: enable=R0903
 
 
+def make_flac(filepath):
+    """Write FLAC file with STREAMINFO block only"""
+    streaminfo = (struct.pack(">HH", 4096, 4096) + b"\x00" * 6 +
+                  struct.pack(">Q", (44100 << 44) | (1 << 41) | (15 << 36)) +
+                  b"\x00" * 16)
+    with open(filepath, "wb") as song:
+        song.write(b"fLaC\x80" + len(streaminfo).to_bytes(3, "big") + streaminfo)
+
+
 def mock_edit_ok(text):
     """Mock click.edit(some_text) function"""
     return text
@@ -63,6 +79,16 @@ def mock_get_audio(_):
     return FakeFile('audio/ogg', ['Artist'], ['Album'], ['Title'], 'Lyrics')
 
 
+def mock_fetch(artist, song, album):
+    """Mock misc.fetch function"""
+    return "Lyrics for %s" % song
+
+
+async def mock_fetch_async(artist, song, album, session=None):
+    """Mock misc.fetch_async coroutine"""
+    return "Lyrics for %s" % song
+
+
 def mock_get_wikia(url, params=None):
     """Mock requests.get call for tests"""
     if re.search("NotFound", url):
@@ -3,10 +3,20 @@ Tests for actions
 """
 from __future__ import unicode_literals
 from __future__ import print_function
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from queue import Queue
+import click
 import mock
 import unittest
 import lyricstagger.actions as a
+import lyricstagger.cache as cache
 import lyricstagger.engine as engine
+import lyricstagger.misc as misc
 from test import fakers
 
 
@@ -26,6 +36,70 @@ class CliCheck(unittest.TestCase):
         self.assertEqual(2, runner.logger.stats['processed'])
         self.assertEqual(0, runner.logger.stats['written'])
 
+    @mock.patch('lyricstagger.misc.get_audio', fakers.mock_get_audio)
+    def test_cli_tag_async_ok_list(self):
+        """Test tag command for real file_list with async engine"""
+        runner = engine.engine(mode="async")
+        runner.run(["test/test_data"], a.tag, progress=True)
+        self.assertEqual(2, runner.logger.stats['processed'])
+        self.assertEqual(0, runner.logger.stats['written'])
+
+    @mock.patch('lyricstagger.misc.get_audio', fakers.mock_get_audio)
+    @mock.patch('lyricstagger.misc.fetch_async', fakers.mock_fetch_async)
+    def test_cli_tag_force_async_ok_list(self):
+        """Test tag --force command for real file_list with async engine"""
+        runner = engine.engine(mode="async")
+        runner.run(["test/test_data"], a.tag_force)
+        self.assertEqual(2, runner.logger.stats['processed'])
+        self.assertEqual(2, runner.logger.stats['written'])
+
+    @mock.patch('lyricstagger.misc.get_audio', fakers.mock_get_audio)
+    @mock.patch('lyricstagger.misc.fetch', fakers.mock_fetch)
+    def test_cli_tag_force_pipeline_ok_list(self):
+        """Test tag --force command for real file_list with pipeline engine"""
+        runner = engine.engine(mode="pipeline", readers=1, writers=1)
+        runner.run(["test/test_data"], a.tag_force, progress=True)
+        self.assertEqual(2, runner.logger.stats['processed'])
+        self.assertEqual(2, runner.logger.stats['written'])
+
+    @mock.patch('lyricstagger.misc.get_audio', fakers.mock_get_audio)
+    def test_cli_remove_pipeline_ok_list(self):
+        """Test remove command for real file_list with pipeline engine"""
+        runner = engine.engine(mode="pipeline")
+        runner.run(["test/test_data"], a.remove)
+        self.assertEqual(2, runner.logger.stats['processed'])
+        self.assertEqual(2, runner.logger.stats['removed'])
+
+    @mock.patch('lyricstagger.misc.get_audio', fakers.mock_get_audio)
+    def test_cli_tag_progress_counts(self):
+        """Test tag command with progress remembers number of files"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            counts_file = os.path.join(tmp_dir, "counts.json")
+            for mode in engine.MODES:
+                runner = engine.engine(mode=mode, counts_file=counts_file)
+                runner.run(["test/test_data"], a.tag, progress=True)
+                self.assertEqual(2, runner.logger.stats['processed'])
+                self.assertEqual(2, misc.load_file_count(counts_file, ["test/test_data"]))
+
+    @mock.patch('lyricstagger.misc.get_audio', fakers.mock_get_audio)
+    def test_cli_remove_small_queue(self):
+        """Test remove command with queue smaller than file_list"""
+        for mode in engine.MODES:
+            for progress in [True, False]:
+                runner = engine.engine(mode=mode, queue_size=1)
+                runner.run(["test/test_data"], a.remove, progress=progress)
+                self.assertEqual(2, runner.logger.stats['processed'])
+                self.assertEqual(2, runner.logger.stats['removed'])
+
+    @mock.patch('lyricstagger.misc.get_audio', fakers.mock_get_audio)
+    def test_cli_remove_autoscale(self):
+        """Test remove command with autoscaled number of threads"""
+        for mode in ["threads", "pipeline"]:
+            runner = engine.engine(mode=mode, threads=1, autoscale=True)
+            runner.run(["test/test_data"], a.remove, progress=True)
+            self.assertEqual(2, runner.logger.stats['processed'])
+            self.assertEqual(2, runner.logger.stats['removed'])
+
     def test_cli_remove_empty_list(self):
         """Test remove command for empty file_list"""
         runner = engine.engine()
@@ -53,7 +127,20 @@ class CliCheck(unittest.TestCase):
         runner = engine.engine()
         runner.run(["test/test_data"], a.edit)
         self.assertEqual(2, runner.logger.stats['processed'])
-        self.assertEqual(2, runner.logger.stats['written'])
+        # editor returned the same lyrics, nothing to save
+        self.assertEqual(0, runner.logger.stats['written'])
+        self.assertEqual(2, runner.logger.stats['unchanged'])
+
+    def test_cli_remove_clean_list(self):
+        """Test remove command doesn't save files without lyrics"""
+        audio = fakers.FakeFile('audio/ogg', 'Artist', 'Album', 'Title')
+        with mock.patch('lyricstagger.misc.get_audio', return_value=audio):
+            with mock.patch.object(audio, 'save') as save:
+                runner = engine.engine()
+                runner.run(["test/test_data"], a.remove)
+                self.assertFalse(save.called)
+        self.assertEqual(0, runner.logger.stats['removed'])
+        self.assertEqual(2, runner.logger.stats['unchanged'])
 
     def test_cli_show_empty_list(self):
         """Test show command for empty file_list"""
@@ -82,3 +169,191 @@ class CliCheck(unittest.TestCase):
         runner.run(["test/test_data"], a.report)
         self.assertEqual(2, runner.logger.stats['processed'])
         self.assertEqual(0, runner.logger.stats['not_found'])
+
+
+class EngineCheck(unittest.TestCase):
+    """Test engine used as library"""
+    @mock.patch('lyricstagger.misc.get_audio', fakers.mock_get_audio)
+    @mock.patch('lyricstagger.misc.fetch', fakers.mock_fetch)
+    @mock.patch('lyricstagger.misc.fetch_async', fakers.mock_fetch_async)
+    def test_reuse_workers(self):
+        """Test engine reuses its threads across runs and stops them"""
+        for mode in engine.MODES:
+            runner = engine.engine(mode=mode, threads=2)
+            results = list(runner.run(["test/test_data"], a.tag_force))
+            threads = [trd for pool in runner._pools for trd in pool.threads]
+            results += list(runner.run(["test/test_data"], a.remove))
+            self.assertEqual(threads,
+                             [trd for pool in runner._pools for trd in pool.threads])
+            runner.close()
+            self.assertFalse(any(trd.is_alive() for trd in threads))
+            self.assertEqual(4, len(results))
+            self.assertEqual(2, runner.logger.stats['written'])
+            self.assertEqual(2, runner.logger.stats['removed'])
+            states = sorted(result.states for result in results)
+            self.assertEqual([["removed", "in_place"]] * 2 +
+                             [["written", "in_place"]] * 2, states)
+            for result in results:
+                self.assertIsNone(result.error)
+                self.assertGreaterEqual(result.elapsed, 0)
+
+    def test_albums_mode(self):
+        """Test albums engine fetches tracks of directory in one thread,
+        grouped by album"""
+        fetched = []
+
+        def fetch(artist, song, album):
+            fetched.append((threading.get_ident(), album))
+            return "Lyrics for %s" % song
+
+        def get_audio(filepath):
+            album = "Second" if "second" in filepath else "First"
+            return fakers.FakeFile('audio/ogg', ['Artist'], [album], ['Title'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ["first_1", "second_1", "first_2", "second_2"]:
+                shutil.copy("test/test_data/test_dir_0/test_file_0.ogg",
+                            os.path.join(tmp_dir, name + ".ogg"))
+            with mock.patch('lyricstagger.misc.get_audio', get_audio), \
+                    mock.patch('lyricstagger.misc.fetch', fetch):
+                runner = engine.engine(mode="albums", threads=2)
+                results = list(runner.run([tmp_dir], a.tag))
+                runner.close()
+        self.assertEqual(4, len(results))
+        self.assertEqual(4, runner.logger.stats['written'])
+        self.assertEqual(1, len(set(ident for ident, _ in fetched)))
+        albums = [album for _, album in fetched]
+        self.assertEqual(sorted(albums), albums)
+
+    def test_shared_resources(self):
+        """Test engines running at once share cache, closing one
+        doesn't close it for other, and other cache file is refused"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_file = os.path.join(tmp_dir, "lyrics.sqlite")
+            first = engine.engine(cache_file=cache_file)
+            second = engine.engine(cache_file=cache_file, threads=2)
+            first.start()
+            second.start()
+            opened = cache.SHARED.store
+            first.close()
+            self.assertIs(cache.SHARED.store, opened)
+            other = engine.engine(cache_file=os.path.join(tmp_dir, "other.sqlite"))
+            with self.assertRaises(ValueError):
+                other.start()
+            self.assertIs(cache.SHARED.store, opened)
+            other.close()
+            second.close()
+            self.assertIsNone(cache.SHARED.store)
+            self.assertIsNone(misc.HEDGE_DELAY)
+
+    def test_scan_counts_before_queueing(self):
+        """Test files are counted as found before workers can take them"""
+        for albums in [False, True]:
+            progress = engine.Progress()
+            queued = []
+            case = self
+
+            class CheckedQueue(Queue):
+                def put(self, item, block=True, timeout=None):
+                    jobs = item.jobs if albums else [item]
+                    queued.extend(jobs)
+                    # worker taking the job can't see more processed than found
+                    case.assertGreaterEqual(progress.found, len(queued))
+                    Queue.put(self, item, block, timeout)
+
+            scanner = engine.ScanThread(["test/test_data"], a.tag, CheckedQueue(),
+                                        Queue(), progress, albums=albums)
+            scanner.run()
+            self.assertEqual(len(queued), 2)
+
+    def test_progress_workers_catch_up(self):
+        """Test progressbar isn't finished when workers catch up with scan"""
+        with click.progressbar(length=0, file=io.StringIO()) as progressbar:
+            progress = engine.Progress(progressbar)
+            for _ in range(3):
+                progress.add_found()
+            progress.update(3)
+            self.assertLess(progressbar.pct, 1.0)
+            for _ in range(97):
+                progress.add_found()
+            progress.update(1)
+            self.assertLess(progressbar.pct, 0.1)
+            progress.finish_scan()
+            progress.update(96)
+            self.assertEqual(progressbar.pct, 1.0)
+            self.assertTrue(progress.finished())
+
+    def test_remove_worker_full_queue(self):
+        """Test removed worker stops after its job, not after queued jobs"""
+        in_queue = Queue()
+        pool = engine.WorkerPool(lambda job: time.sleep(0.01), 2, in_queue)
+        for number in range(100):
+            in_queue.put(number)
+        pool.remove_worker()
+        time.sleep(0.1)
+        self.assertEqual(1, sum(each.is_alive() for each in pool.threads))
+        self.assertFalse(in_queue.empty())
+        pool.stop()
+        self.assertTrue(in_queue.empty())
+
+    @mock.patch('lyricstagger.misc.get_audio', fakers.mock_get_audio)
+    def test_async_slow_scan(self):
+        """Test async engine processes found files while scan is blocked"""
+        def slow_file_list(path_list, threads=8):
+            yield "test/test_data/test_dir_0/test_file_0.ogg"
+            time.sleep(0.5)
+            yield "test/test_data/test_dir_1/test_file_1.ogg"
+
+        runner = engine.engine(mode="async")
+        with mock.patch('lyricstagger.misc.get_file_list', slow_file_list):
+            started = time.monotonic()
+            results = runner.iter_run(["test/test_data"], a.remove)
+            next(results)
+            self.assertLess(time.monotonic() - started, 0.4)
+            self.assertEqual(1, len(list(results)))
+        runner.close()
+
+    def test_results_error(self):
+        """Test results report failed files"""
+        runner = engine.engine()
+        with mock.patch('lyricstagger.misc.get_audio', side_effect=IOError("broken")):
+            results = list(runner.iter_run(["test/test_data"], a.remove))
+        runner.close()
+        self.assertEqual(2, len(results))
+        for result in results:
+            self.assertEqual(result.error, "broken")
+            self.assertEqual(result.states, [])
+
+
+class AutoscalerCheck(unittest.TestCase):
+    """Test adjusting number of threads"""
+    def setUp(self):
+        self.scaler = engine.Autoscaler(None, None, engine.WorkStats(), 4, 64)
+
+    def test_adjust_growing(self):
+        """Test adding threads while throughput grows"""
+        self.assertEqual(1, self.scaler.adjust(10, 10.0, 0, 1.0))
+        self.assertEqual(1, self.scaler.adjust(20, 20.0, 0, 1.0))
+        self.assertEqual(0, self.scaler.adjust(21, 21.0, 0, 1.0))
+        self.assertEqual(0, self.scaler.adjust(0, 0.0, 0, 1.0))
+
+    def test_adjust_worse(self):
+        """Test going back when throughput drops"""
+        self.assertEqual(1, self.scaler.adjust(20, 20.0, 0, 1.0))
+        self.assertEqual(-1, self.scaler.adjust(10, 10.0, 0, 1.0))
+
+    def test_adjust_after_fast_interval(self):
+        """Test fast interval of skipped files doesn't pin workers to one
+        when lookups scale with number of workers"""
+        workers = 4
+        # quick skips first, then lookups taking one second each
+        self.scaler.adjust(400, 4.0, 0, 1.0)
+        for _ in range(20):
+            change = self.scaler.adjust(workers, float(workers), 0, 1.0)
+            workers = min(max(workers + change, 1), 64)
+        self.assertGreater(workers, 4)
+
+    def test_adjust_errors(self):
+        """Test removing threads on errors and latency growth"""
+        self.assertEqual(-1, self.scaler.adjust(10, 10.0, 1, 1.0))
+        self.assertEqual(-1, self.scaler.adjust(20, 40.0, 0, 1.0))
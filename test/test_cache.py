@@ -0,0 +1,95 @@
+"""
+Tests for lyrics_tagger
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+import os
+import tempfile
+import unittest
+import mock
+import requests
+import lyricstagger.cache as cache
+import lyricstagger.misc as misc
+import lyricstagger.helpers as hlp
+from lyricstagger.helpers import network
+from test import fakers
+
+
+# pylint: disable=R0904
+class CacheCheck(unittest.TestCase):
+    """Test persistent lyrics cache"""
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.tmpdir.name, "lyrics.sqlite")
+
+    def tearDown(self):
+        cache.stop()
+        self.tmpdir.cleanup()
+
+    def test_lookup(self):
+        """Test cached hits and misses with normalized keys"""
+        db = cache.Cache(self.cache_file)
+        self.assertIs(db.lookup("Artist", "Song", "Album"), cache.MISSING)
+        db.update("Artist", "Song", "Album", "Lyrics")
+        db.update("Artist", "Other  song", None, None)
+        self.assertEqual(db.lookup(" artist", "SONG", "Album "), "Lyrics")
+        self.assertIsNone(db.lookup("Artist", "Other song", ""))
+        db.close()
+        db = cache.Cache(self.cache_file)
+        self.assertEqual(db.lookup("Artist", "Song", "Album"), "Lyrics")
+        db.close()
+
+    def test_expired(self):
+        """Test misses expire separately from hits"""
+        db = cache.Cache(self.cache_file, miss_ttl=-1)
+        db.update("Artist", "Song", "Album", "Lyrics")
+        db.update("Artist", "Other song", "Album", None)
+        self.assertEqual(db.lookup("Artist", "Song", "Album"), "Lyrics")
+        self.assertIs(db.lookup("Artist", "Other song", "Album"), cache.MISSING)
+        db.close()
+
+    def test_pages(self):
+        """Test resolved pages and missing pages are cached per site"""
+        db = cache.Cache(self.cache_file)
+        self.assertIs(db.lookup_page("site", "Artist", "Song"), cache.MISSING)
+        db.update_page("site", "Artist", "Song", "http://site/Artist:Song")
+        db.update_page("site", "Artist", "Missing", "")
+        self.assertEqual(db.lookup_page("site", "artist", "Song "), "http://site/Artist:Song")
+        self.assertEqual(db.lookup_page("site", "Artist", "Missing"), "")
+        self.assertIs(db.lookup_page("other", "Artist", "Song"), cache.MISSING)
+        db.close()
+
+    def test_fetch_throttled(self):
+        """Test misses are not cached when website throttled lookup"""
+        cache.start(self.cache_file)
+        urls = []
+
+        def get(url, params=None):
+            urls.append(url)
+            if "wikia" in url:
+                return fakers.MockResponse(429, "Too many requests")
+            return fakers.mock_get_darklyrics(url, params)
+
+        helpers = [hlp.Wikia(), hlp.DarkLyrics()]
+        with mock.patch.dict(network.LIMITERS, clear=True), \
+                mock.patch('lyricstagger.misc.hlp.HELPERS', helpers), \
+                mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(get)):
+            self.assertIsNone(misc.fetch("Artist", "NotFound", "Album"))
+            self.assertIs(cache.lookup("Artist", "NotFound", "Album"), cache.MISSING)
+            requests_made = len(urls)
+            self.assertIsNone(misc.fetch("Artist", "NotFound", "Album"))
+            self.assertGreater(len(urls), requests_made)
+
+    def test_fetch_cached(self):
+        """Test fetch asks helpers only about new songs"""
+        cache.start(self.cache_file)
+        helper = mock.Mock()
+        helper.fetch.return_value = None
+        with mock.patch('lyricstagger.misc.hlp.HELPERS', [helper]):
+            self.assertIsNone(misc.fetch("Artist", "Song", "Album"))
+            self.assertIsNone(misc.fetch("Artist", "Song", "Album"))
+            self.assertEqual(helper.fetch.call_count, 1)
+            helper.fetch.side_effect = requests.ConnectionError("Failed")
+            self.assertIsNone(misc.fetch("Artist", "New song", "Album"))
+            self.assertIs(cache.lookup("Artist", "New song", "Album"),
+                          cache.MISSING)
@@ -2,9 +2,15 @@
 """
 Tests for Wikia helper
 """
+import asyncio
+import sys
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 import mock
+import lyricstagger.helpers as helpers
 from lyricstagger.helpers import DarkLyrics
+from lyricstagger.helpers import darklyrics, network, parsing
 from test import fakers
 
 
@@ -12,6 +18,12 @@ from test import fakers
 class DarkLyricsCheck(unittest.TestCase):
     """Tests for darklyrics.com downloader"""
 
+    def setUp(self):
+        # don't wait for website rate limits with mocked requests
+        patcher = mock.patch.dict(network.LIMITERS, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_parse_artist_link_bad(self):
         """Test DarkLyrics.get_artist_link function with bad data"""
         bad_data = "<body>testdata<br></body>"
@@ -66,6 +78,15 @@ class DarkLyricsCheck(unittest.TestCase):
         self.assertNotEqual(link, None)
         self.assertEqual(link, "http://www.darklyrics.com/lyrics/immortal/blizzardbeasts.html")
 
+    def test_find_album_link(self):
+        """Test album link lookup in parsed artist page"""
+        albums = {"battles in the north": "battles.html",
+                  "blizzard beasts": "blizzard.html"}
+        self.assertEqual(DarkLyrics.find_album_link(albums, "Blizzard  Beasts"),
+                         "blizzard.html")
+        self.assertEqual(DarkLyrics.find_album_link(albums, "Battles"), "battles.html")
+        self.assertEqual(DarkLyrics.find_album_link(albums, "Damned"), "")
+
     def test_parser_bad(self):
         """Test DarkLyrics.parse function with bad data"""
         bad_data = "<body>testdata<br>lyricbox</body>"
@@ -95,14 +116,30 @@ class DarkLyricsCheck(unittest.TestCase):
         self.assertNotEqual(good_lyrics, None)
         self.assertEqual(good_lyrics, "Mother winter leaves our land\nIt says: Set your sails")
 
-    @mock.patch('lyricstagger.helpers.darklyrics.requests.get', fakers.mock_get_darklyrics)
+    def test_parser_backends(self):
+        """Test DarkLyrics.parse_album gives the same result with all backends"""
+        page = fakers.mock_get_darklyrics(
+            "http://www.darklyrics.com/lyrics/immortal/blizzardbeasts.html").text
+        results = []
+        for backend in parsing.BACKENDS:
+            with mock.patch.object(parsing, 'BACKEND', backend):
+                results.append(DarkLyrics.parse_album(page))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0]["shores in flames"],
+                         "Mother winter leaves our land\nIt says: Set your sails")
+        with mock.patch.object(parsing, 'lxml', None):
+            with mock.patch.object(parsing, 'BACKEND', "lxml"):
+                parsing.set_backend("lxml")
+                self.assertEqual(parsing.BACKEND, "html.parser")
+
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_darklyrics))
     def test_getter_not_found(self):
         """Test DarkLyrics.fetch for 404 code"""
         helper = DarkLyrics()
         data = helper.fetch("Artist", "NotFound", "Some Album")
         self.assertEqual(data, None)
 
-    @mock.patch('lyricstagger.helpers.darklyrics.requests.get', fakers.mock_get_darklyrics)
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_darklyrics))
     def test_fetch_normal(self):
         """Test DarkLyrics.fetch for existing track"""
         helper = DarkLyrics()
@@ -110,6 +147,91 @@ class DarkLyricsCheck(unittest.TestCase):
         self.assertNotEqual(lyrics, None)
         self.assertEqual(lyrics, "Mother winter leaves our land\nIt says: Set your sails")
 
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_darklyrics))
+    def test_fetch_parse_processes(self):
+        """Test DarkLyrics.fetch parsing html in process pool"""
+        helper = DarkLyrics()
+        parsing.start(2)
+        try:
+            lyrics = helper.fetch("Immortal", "Shores In Flames", "Blizzard Beasts")
+        finally:
+            parsing.stop()
+        self.assertEqual(lyrics, "Mother winter leaves our land\nIt says: Set your sails")
+
+    @mock.patch('lyricstagger.helpers.network.aiohttp', None)
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_darklyrics))
+    def test_fetch_async_normal(self):
+        """Test DarkLyrics.fetch_async for existing track"""
+        helper = DarkLyrics()
+        loop = asyncio.new_event_loop()
+        try:
+            lyrics = loop.run_until_complete(
+                helper.fetch_async("Immortal", "Shores In Flames", "Blizzard Beasts"))
+        finally:
+            loop.close()
+        self.assertEqual(lyrics, "Mother winter leaves our land\nIt says: Set your sails")
+
+    def test_cache_lru(self):
+        """Test cache evicts least recently used entries when full"""
+        cache = darklyrics.Cache(max_size=3 * sys.getsizeof("a" * 100))
+        for album in ["A", "B", "C"]:
+            cache.put(("album", "Artist", album), "a" * 100)
+        self.assertEqual(cache.get(("album", "Artist", "A")), "a" * 100)
+        cache.put(("album", "Artist", "D"), "a" * 100)
+        self.assertIs(cache.get_album("Artist", "B"), darklyrics.MISSING)
+        self.assertEqual(cache.get_album("Artist", "A"), "a" * 100)
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["entries"], 3)
+
+    def test_cache_resize(self):
+        """Test engine sets cache size of helpers for its runs"""
+        helper = DarkLyrics()
+        for album in ["A", "B", "C"]:
+            helper.cache.put(("album", "Artist", album), "a" * 100)
+        with mock.patch('lyricstagger.helpers.HELPERS', [helper]):
+            helpers.SHARED_CACHE_SIZE.acquire(sys.getsizeof("a" * 100))
+            self.assertEqual(helper.cache.stats()["entries"], 1)
+            self.assertEqual(helpers.cache_stats()["evictions"], 2)
+            helpers.SHARED_CACHE_SIZE.release()
+        self.assertEqual(helper.cache.max_size, darklyrics.CACHE_SIZE)
+
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_darklyrics))
+    def test_fetch_cached_album(self):
+        """Test DarkLyrics.fetch keeps parsed album in cache"""
+        helper = DarkLyrics()
+        helper.fetch("Immortal", "Shores In Flames", "Blizzard Beasts")
+        songs = helper.cache.get_album("Immortal", "Blizzard Beasts")
+        self.assertEqual(songs, {"shores in flames":
+                                 "Mother winter leaves our land\nIt says: Set your sails"})
+        with mock.patch('lyricstagger.helpers.network.SESSION') as session:
+            lyrics = helper.fetch("Immortal", "shores  in flames", "Blizzard Beasts")
+            self.assertFalse(session.get.called)
+        self.assertEqual(lyrics, "Mother winter leaves our land\nIt says: Set your sails")
+
+
+    def test_fetch_single_flight(self):
+        """Test concurrent lookups of the same album make one set of requests"""
+        helper = DarkLyrics()
+        urls = []
+
+        def slow_get(url, params=None):
+            urls.append(url)
+            time.sleep(0.05)
+            return fakers.mock_get_darklyrics(url, params)
+
+        songs = ["Shores In Flames"] * 3 + ["Valhalla"]
+        with mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(slow_get)):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(
+                    lambda song: helper.fetch("Immortal", song, "Blizzard Beasts"),
+                    songs))
+        self.assertEqual(len(urls), 3)
+        self.assertEqual(results[:3], ["Mother winter leaves our land\nIt says: Set your sails"] * 3)
+        self.assertIsNone(results[3])
+
 
 # pylint: enable=R0904
 if __name__ == '__main__':
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for Local helper
+"""
+import asyncio
+import os
+import tempfile
+import unittest
+import mock
+import lyricstagger.cache as cache
+import lyricstagger.misc as misc
+from lyricstagger.helpers import Local
+from lyricstagger.helpers import local
+
+
+# pylint: disable=R0904
+class LocalCheck(unittest.TestCase):
+    """Tests for local lyrics database"""
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "library.sqlite")
+
+    def tearDown(self):
+        local.stop()
+        cache.stop()
+        self.tmpdir.cleanup()
+
+    def write(self, name: str, text: str) -> str:
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w", encoding="utf-8") as dump:
+            dump.write(text)
+        return path
+
+    def test_fetch_closed(self):
+        """Test Local.fetch without database"""
+        self.assertIsNone(Local.fetch("Immortal", "Shores In Flames", "Battles"))
+
+    def test_import_dumps(self):
+        """Test import of JSONL and CSV dumps, skipping broken records"""
+        library = local.Library(self.path)
+        jsonl = self.write("dump.jsonl",
+                           '{"artist": "Immortal", "title": "Shores In Flames", '
+                           '"album": "Battles", "lyrics": "Mother winter"}\n'
+                           'broken\n\n"text"\n[1, 2]\nnull\n'
+                           '{"artist": "Immortal", "song": "Valhalla"}\n')
+        csv = self.write("dump.csv", 'artist,song,album,lyrics\n'
+                                     'Some Artist,Some Track,,"Some\nlyrics"\n')
+        self.assertEqual(library.import_file(jsonl), 1)
+        self.assertEqual(library.import_file(csv), 1)
+        self.assertEqual(library.lookup("some artist", "Some Track", None), "Some\nlyrics")
+        self.assertIsNone(library.lookup("Immortal", "Valhalla", "Battles"))
+        library.close()
+
+    def test_lookup(self):
+        """Test lookup by normalized tags and by words"""
+        library = local.Library(self.path)
+        library.add("Immortal", "Shores In Flames", "Battles", "Battles lyrics")
+        library.add("Immortal", "Shores In Flames", "Live", "Live lyrics")
+        library.add("Immortal", "Shores In Flames (Demo)", "Demo", "Demo lyrics")
+        self.assertEqual(library.lookup("immortal", "shores  in flames", "Live"), "Live lyrics")
+        self.assertIn(library.lookup("Immortal", "Shores In Flames", "Other"),
+                      ["Battles lyrics", "Live lyrics"])
+        self.assertEqual(library.lookup("Immortal", "Shores, In Flames!", ""), "Battles lyrics")
+        self.assertIsNone(library.lookup("Immortal", "Shores", ""))
+        self.assertIsNone(library.lookup("Immortal", "!!!", ""))
+        library.close()
+        library = local.Library(self.path)
+        self.assertEqual(library.lookup("Immortal", "Shores in flames (demo)", ""), "Demo lyrics")
+        library.close()
+
+    def test_update(self):
+        """Test new lyrics for song replace old ones, full-text index
+        keeps finding it"""
+        library = local.Library(self.path)
+        library.add("Immortal", "Shores In Flames", "Battles", "Old lyrics")
+        library.add("Immortal", "Shores In Flames", "Battles", "New lyrics")
+        self.assertEqual(library.lookup("Immortal", "Shores, In Flames!", ""), "New lyrics")
+        self.assertEqual(library.db.execute("SELECT COUNT(*) FROM songs").fetchone()[0], 1)
+        library.close()
+
+    def test_import_cache(self):
+        """Test lyrics found on previous runs are imported from cache"""
+        cache_file = os.path.join(self.tmpdir.name, "lyrics.sqlite")
+        db = cache.Cache(cache_file)
+        db.update("Artist", "Song", "Album", "Lyrics")
+        db.update("Artist", "Missing", "Album", None)
+        db.close()
+        library = local.Library(self.path)
+        self.assertEqual(library.import_cache(cache_file), 1)
+        self.assertEqual(library.lookup("Artist", "Song", "Album"), "Lyrics")
+        library.close()
+
+    def test_fetch_first(self):
+        """Test fetch finds lyrics in database without asking websites,
+        lyrics found by them are kept in cache only until imported"""
+        cache_file = os.path.join(self.tmpdir.name, "lyrics.sqlite")
+        cache.start(cache_file)
+        local.start(self.path)
+        website = mock.Mock(url="http://example.com")
+        website.fetch.return_value = "Website lyrics"
+        with mock.patch('lyricstagger.helpers.HELPERS', [Local(), website]):
+            self.assertEqual(misc.fetch("Artist", "Song", "Album"), "Website lyrics")
+            self.assertIsNone(Local.fetch("Artist", "Song", "Album"))
+            cache.stop()
+            local.SHARED.store.import_cache(cache_file)
+            self.assertEqual(misc.fetch("Artist", "Song", "Album"), "Website lyrics")
+            self.assertEqual(website.fetch.call_count, 1)
+            with mock.patch.object(misc, 'OFFLINE', True):
+                self.assertIsNone(misc.fetch("Artist", "Other song", "Album"))
+            self.assertEqual(website.fetch.call_count, 1)
+        loop = asyncio.new_event_loop()
+        try:
+            lyrics = loop.run_until_complete(Local.fetch_async("Artist", "Song", "Album"))
+        finally:
+            loop.close()
+        self.assertEqual(lyrics, "Website lyrics")
+
+    def test_offline_miss(self):
+        """Test offline miss is not cached, websites are asked next time"""
+        cache.start(os.path.join(self.tmpdir.name, "lyrics.sqlite"))
+        local.start(self.path)
+        website = mock.Mock(url="http://example.com")
+        website.fetch.return_value = "Website lyrics"
+        with mock.patch('lyricstagger.helpers.HELPERS', [Local(), website]):
+            with mock.patch.object(misc, 'OFFLINE', True):
+                self.assertIsNone(misc.fetch("Artist", "Song", "Album"))
+            self.assertFalse(website.fetch.called)
+            self.assertIs(cache.lookup("Artist", "Song", "Album"), cache.MISSING)
+            self.assertEqual(misc.fetch("Artist", "Song", "Album"), "Website lyrics")
+
+    def test_no_fts(self):
+        """Test database works with exact lookups without full-text search"""
+        library = local.Library(self.path)
+        library.fts = False
+        library.add("Artist", "Song", "Album", "Lyrics")
+        self.assertEqual(library.lookup("Artist", "Song", ""), "Lyrics")
+        self.assertIsNone(library.lookup("Artist", "Song!", ""))
+        library.close()
+
+
+# pylint: enable=R0904
+if __name__ == '__main__':
+    unittest.main()
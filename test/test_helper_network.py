@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for network access shared by helpers
+"""
+import asyncio
+import http.server
+import threading
+import time
+from concurrent.futures import Future
+import unittest
+import mock
+import requests
+from lyricstagger.helpers import network
+from test import fakers
+
+
+# pylint: disable=R0904
+class NetworkCheck(unittest.TestCase):
+    """Tests for request steps drivers and limiters"""
+
+    def test_limiter_rate(self):
+        """Test Limiter delays requests above rate"""
+        limiter = network.Limiter(20.0, 1)
+        start = time.monotonic()
+        for _ in range(30):
+            limiter.acquire()
+            limiter.release()
+        # 20 requests burst, then 10 more at 20 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.45)
+
+    def test_limiter_concurrent(self):
+        """Test Limiter caps concurrent requests"""
+        limiter = network.Limiter(1000.0, 2)
+        limiter.acquire()
+        limiter.acquire()
+        self.assertFalse(limiter.slots.acquire(blocking=False))
+        limiter.release()
+        self.assertTrue(limiter.slots.acquire(blocking=False))
+
+    def test_limiter_concurrent_async(self):
+        """Test Limiter caps concurrent requests of coroutines"""
+        limiter = network.Limiter(1000.0, 1)
+        limiter.acquire()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.call_later(0.05, limiter.release)
+            loop.run_until_complete(asyncio.wait_for(limiter.acquire_async(), 1))
+        finally:
+            loop.close()
+        self.assertFalse(limiter.slots.acquire(blocking=False))
+
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_wikia))
+    def test_get_limited(self):
+        """Test get releases limiter slot after request"""
+        with mock.patch.dict(network.LIMITERS, clear=True):
+            network.set_limit("http://example.com/path", 100.0, 1)
+            for _ in range(3):
+                response = network.get("http://example.com/Artist:Some_Track")
+                self.assertEqual(response.status_code, 200)
+            self.assertIsNotNone(network.get_limiter("http://example.com/other"))
+            self.assertIsNone(network.get_limiter("http://example.org/"))
+
+
+    def test_run_throws_errors(self):
+        """Test errors of futures are thrown into steps"""
+        def steps():
+            future = Future()
+            future.set_exception(ValueError("failed"))
+            try:
+                yield future
+            except ValueError as error:
+                return str(error)
+
+        self.assertEqual(network.run(steps()), "failed")
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(loop.run_until_complete(network.run_async(steps())),
+                             "failed")
+        finally:
+            loop.close()
+
+    def test_run_calls(self):
+        """Test calls are run by blocking driver, and in executor by coroutines"""
+        def steps():
+            thread = yield network.Call(threading.get_ident, ())
+            return thread
+
+        self.assertEqual(network.run(steps()), threading.get_ident())
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertNotEqual(loop.run_until_complete(network.run_async(steps())),
+                                threading.get_ident())
+        finally:
+            loop.close()
+
+    def test_run_throws_http_errors(self):
+        """Test throttled and failed responses are thrown into steps"""
+        def steps():
+            try:
+                response = yield network.Request("http://example.com", None)
+            except requests.HTTPError as error:
+                return str(error)
+            return response.status_code
+
+        for status_code, result in [(429, "Got code 429"), (503, "Got code 503"), (404, 404)]:
+            session = fakers.FakeSession(lambda url, params=None: fakers.MockResponse(status_code, ""))
+            with mock.patch('lyricstagger.helpers.network.SESSION', session):
+                self.assertEqual(network.run(steps()), result)
+
+    def test_session_reuse(self):
+        """Test shared session keeps connection alive between requests"""
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *_):
+                pass
+
+        server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            with mock.patch.object(network, 'SESSION', None):
+                network.start_session(2)
+                url = "http://127.0.0.1:%d/" % server.server_port
+                for _ in range(3):
+                    self.assertEqual(network.get(url).text, "ok")
+                self.assertEqual(network.connections(), 1)
+                network.SESSION.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+
+# pylint: enable=R0904
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,15 @@
 """
 Tests for Wikia helper
 """
+import asyncio
+import os
+import tempfile
 import unittest
 import mock
+import requests
 from lyricstagger.helpers import Wikia
+from lyricstagger.helpers import parsing
+import lyricstagger.cache as cache
 from test import fakers
 
 
@@ -86,20 +92,20 @@ class WikiaCheck(unittest.TestCase):
         self.assertEqual(good_lyrics, ("They say, influenced by crime, "
                                        "addicted to grindin'"))
 
-    @mock.patch('lyricstagger.helpers.wikia.requests.get', fakers.mock_get_wikia)
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_wikia))
     def test_getter_not_found(self):
         """Test Wikia.get_raw_data for 404 code"""
         data = Wikia.get_raw_data("Artist", "NotFound")
         self.assertEqual(data, None)
 
-    @mock.patch('lyricstagger.helpers.wikia.requests.get', fakers.mock_get_wikia)
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_wikia))
     def test_getter_normal(self):
         """Test Wikia.get_raw_data for existing track"""
         data = Wikia.get_raw_data("Some Artist", "Some Track")
         self.assertNotEqual(data, None)
         self.assertEqual(data[0], '<div class="lyricbox">Some lyrics</div>')
 
-    @mock.patch('lyricstagger.helpers.wikia.requests.get', fakers.mock_get_wikia)
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_wikia))
     def test_getter_normal_gracenote(self):
         """Test Wikia.get_raw_data for existing gracenote track"""
         data = Wikia.get_raw_data("Some Artist",
@@ -109,26 +115,107 @@ class WikiaCheck(unittest.TestCase):
                                    '<p>Gracenote</p></div>'))
         self.assertEqual(data[1], True)
 
-    @mock.patch('lyricstagger.helpers.wikia.requests.get', fakers.mock_get_wikia)
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_wikia))
     def test_fetch_normal(self):
         """Test Wikia.fetch for existing track"""
         lyrics = Wikia.fetch("Some Artist", "Some Track", "Some Album")
         self.assertNotEqual(lyrics, None)
         self.assertEqual(lyrics, "Some lyrics")
 
-    @mock.patch('lyricstagger.helpers.wikia.requests.get', fakers.mock_get_wikia)
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_wikia))
     def test_fetch_gracenote(self):
         """Test Wikia.fetch for existing gracenote track"""
         lyrics = Wikia.fetch("Some Artist", "Gracenote Track", "Some Album")
         self.assertNotEqual(lyrics, None)
         self.assertEqual(lyrics, "Gracenote")
 
-    @mock.patch('lyricstagger.helpers.wikia.requests.get', fakers.mock_get_wikia)
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_wikia))
     def test_fetch_missing(self):
         """Test Wikia.fetch for existing gracenote track"""
         lyrics = Wikia.fetch("Some Artist", "NotFound", "Some Album")
         self.assertEqual(lyrics, None)
 
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_wikia))
+    def test_fetch_parse_processes(self):
+        """Test Wikia.fetch parsing html in process pool"""
+        parsing.start(1)
+        try:
+            lyrics = Wikia.fetch("Some Artist", "Gracenote Track", "Some Album")
+        finally:
+            parsing.stop()
+        self.assertEqual(lyrics, "Gracenote")
+
+    @mock.patch('lyricstagger.helpers.network.aiohttp', None)
+    @mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(fakers.mock_get_wikia))
+    def test_fetch_async_gracenote(self):
+        """Test Wikia.fetch_async for existing gracenote track"""
+        loop = asyncio.new_event_loop()
+        try:
+            lyrics = loop.run_until_complete(
+                Wikia.fetch_async("Some Artist", "Gracenote Track", "Some Album"))
+        finally:
+            loop.close()
+        self.assertEqual(lyrics, "Gracenote")
+
+    def test_fetch_cached_page(self):
+        """Test Wikia.fetch goes straight to page resolved before,
+        and doesn't ask for missing pages again"""
+        urls = []
+
+        def get(url, params=None):
+            urls.append(url)
+            if params and params['song'] == "Missing Track":
+                return fakers.MockResponse(
+                    200, "song = {'url':'http://lyrics.wikia.com/index.php?"
+                         "title=Some_Artist:Missing_Track&action=edit'}")
+            return fakers.mock_get_wikia(url, params)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache.start(os.path.join(tmp_dir, "lyrics.sqlite"))
+            try:
+                with mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(get)):
+                    for _ in range(2):
+                        self.assertEqual(Wikia.fetch("Some Artist", "Gracenote Track", ""),
+                                         "Gracenote")
+                        self.assertIsNone(Wikia.fetch("Some Artist", "Missing Track", ""))
+            finally:
+                cache.stop()
+        # api, page and its Gracenote variant, then api for missing song,
+        # second time only Gracenote page
+        self.assertEqual(len(urls), 5)
+        self.assertEqual(urls[0], urls[3])
+        self.assertEqual(urls[2], urls[4])
+        self.assertIn("/Gracenote:", urls[4])
+
+    def test_fetch_page_error_not_cached(self):
+        """Test failed page is not cached as missing song"""
+        def get(url, params=None):
+            if params:
+                return fakers.mock_get_wikia(url, params)
+            if "/Gracenote:" in url:
+                return fakers.MockResponse(404, "")
+            return fakers.MockResponse(self.status_code, "")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache.start(os.path.join(tmp_dir, "lyrics.sqlite"))
+            try:
+                with mock.patch('lyricstagger.helpers.network.SESSION', fakers.FakeSession(get)):
+                    self.status_code = 403
+                    self.assertIsNone(Wikia.fetch("Some Artist", "Some Track", ""))
+                    self.assertIs(cache.lookup_page(Wikia.site, "Some Artist", "Some Track"),
+                                  cache.MISSING)
+                    self.status_code = 503
+                    with self.assertRaises(requests.HTTPError):
+                        Wikia.fetch("Some Artist", "Some Track", "")
+                    self.assertIs(cache.lookup_page(Wikia.site, "Some Artist", "Some Track"),
+                                  cache.MISSING)
+                    self.status_code = 404
+                    self.assertIsNone(Wikia.fetch("Some Artist", "Some Track", ""))
+                    self.assertEqual(cache.lookup_page(Wikia.site, "Some Artist", "Some Track"), "")
+            finally:
+                cache.stop()
+
+
 # pylint: enable=R0904
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+"""
+Tests for lyrics_tagger
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+import os
+import tempfile
+import unittest
+import mock
+import lyricstagger.actions as actions
+import lyricstagger.index as index
+import lyricstagger.log as log
+import test.fakers as fakers
+
+
+# pylint: disable=R0904
+class IndexCheck(unittest.TestCase):
+    """Test persistent index of files tags"""
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmpdir.name, "song.ogg")
+        with open(self.filepath, "w") as song:
+            song.write("audio")
+        self.index_file = os.path.join(self.tmpdir.name, "index.sqlite")
+        self.data = dict(artist="Artist", album="Album", title="Title")
+
+    def tearDown(self):
+        index.stop()
+        self.tmpdir.cleanup()
+
+    def test_lookup(self):
+        """Test lookup of indexed file"""
+        db = index.Index(self.index_file)
+        self.assertEqual(db.lookup(self.filepath), None)
+        db.update(self.filepath, self.data, True)
+        self.assertEqual(db.lookup(self.filepath), index.Entry(self.data, True))
+        db.update(self.filepath, None, False)
+        self.assertEqual(db.lookup(self.filepath), index.Entry(None, False))
+        db.close()
+
+    def test_persist(self):
+        """Test index is kept between runs"""
+        db = index.Index(self.index_file)
+        db.update(self.filepath, self.data, False)
+        db.close()
+        db = index.Index(self.index_file)
+        self.assertEqual(db.lookup(self.filepath),
+                         index.Entry(self.data, False))
+        db.close()
+
+    def test_modified(self):
+        """Test modified file is not taken from index"""
+        db = index.Index(self.index_file)
+        db.update(self.filepath, self.data, False)
+        with open(self.filepath, "a") as song:
+            song.write("more audio")
+        self.assertEqual(db.lookup(self.filepath), None)
+        db.close()
+
+    def test_same_file(self):
+        """Test file indexed by one path is found by other path to it"""
+        db = index.Index(self.index_file)
+        db.update(self.filepath, self.data, False)
+        link = os.path.join(self.tmpdir.name, "link")
+        os.symlink(self.tmpdir.name, link)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        try:
+            self.assertEqual(db.lookup("song.ogg"), index.Entry(self.data, False))
+            db.update("song.ogg", self.data, True)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(db.lookup(os.path.join(link, "song.ogg")),
+                         index.Entry(self.data, True))
+        self.assertEqual(db.db.execute("SELECT COUNT(*) FROM files").fetchone()[0], 1)
+        db.close()
+
+    def test_report_indexed(self):
+        """Test report doesn't open indexed files"""
+        index.start(self.index_file)
+        logger = log.CliLogger()
+        audio = fakers.FakeFile('audio/ogg', 'Artist', 'Album', 'Title')
+        with mock.patch('lyricstagger.misc.get_audio', return_value=audio):
+            actions.report(logger, self.filepath)
+        with mock.patch('lyricstagger.misc.get_audio') as get_audio:
+            actions.report(logger, self.filepath)
+            self.assertFalse(get_audio.called)
+        self.assertEqual(logger.stats["not_found"], 2)
+
+    def test_tag_indexed(self):
+        """Test tag skips indexed files with lyrics"""
+        index.start(self.index_file)
+        index.update(self.filepath, self.data, True)
+        logger = log.CliLogger()
+        with mock.patch('lyricstagger.misc.get_audio') as get_audio:
+            self.assertEqual(actions.read(logger, self.filepath), None)
+            track = actions.read(logger, self.filepath, overwrite=True)
+            self.assertFalse(get_audio.called)
+        self.assertEqual(track.data, self.data)
@@ -3,12 +3,35 @@ Tests for lyrics_tagger
 """
 from __future__ import unicode_literals
 from __future__ import print_function
+import asyncio
+import os
+import tempfile
+import time
 import unittest
 import mock
+from mutagen import id3
 import lyricstagger.misc as misc
+from lyricstagger.helpers import darklyrics, network
 import test.fakers as fakers
 
 
+class SlowHelper(object):
+    """Helper answering after delay"""
+    url = "http://example.com"
+
+    def __init__(self, lyrics: str, delay: float):
+        self.lyrics = lyrics
+        self.delay = delay
+
+    def fetch(self, artist, song, album):
+        time.sleep(self.delay)
+        return self.lyrics
+
+    async def fetch_async(self, artist, song, album, session=None):
+        await asyncio.sleep(self.delay)
+        return self.lyrics
+
+
 # pylint: disable=R0904
 class MiscCheck(unittest.TestCase):
     """Test miscelanous functions"""
@@ -76,6 +99,143 @@ class MiscCheck(unittest.TestCase):
         self.assertIn("test/test_data/test_dir_0/test_file_0.ogg", file_list)
         self.assertIn("test/test_data/test_dir_1/test_file_1.ogg", file_list)
 
+    def test_get_file_list_tree(self):
+        """Test get_file_list on deep tree with unsupported files and links"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected = []
+            for artist in range(3):
+                for album in range(3):
+                    album_dir = os.path.join(tmp_dir, "a%d" % artist, "b%d" % album)
+                    os.makedirs(album_dir)
+                    for name in ["1.mp3", "2.FLAC", "3.ogg", "cover.jpg", "mp3"]:
+                        open(os.path.join(album_dir, name), "w").close()
+                    expected += [os.path.join(album_dir, name)
+                                 for name in ["1.mp3", "2.FLAC", "3.ogg"]]
+            os.symlink(os.path.join(tmp_dir, "a0"), os.path.join(tmp_dir, "link"))
+            for threads in [1, 4]:
+                file_list = list(misc.get_file_list([tmp_dir], threads))
+                self.assertEqual(sorted(expected), sorted(file_list))
+
+    def test_file_count(self):
+        """Test saving and loading file count for path list"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            counts_file = os.path.join(tmp_dir, "cache", "counts.json")
+            self.assertEqual(misc.load_file_count(counts_file, ["a", "b"]), 0)
+            misc.save_file_count(counts_file, ["a", "b"], 10)
+            misc.save_file_count(counts_file, ["c"], 5)
+            self.assertEqual(misc.load_file_count(counts_file, ["b", "a"]), 10)
+            self.assertEqual(misc.load_file_count(counts_file, ["c"]), 5)
+
+    def test_get_tags_other_lyrics(self):
+        """Test lyrics frame with other description is the same lyrics
+        for get_tags and has_lyrics"""
+        audio = fakers.FakeFile('audio/mp3', ['Artist'], ['Album'], ['Title'])
+        self.assertNotIn("lyrics", misc.get_tags(audio))
+        self.assertFalse(misc.has_lyrics(audio))
+        audio["USLT::eng"] = id3.USLT(encoding=3, lang="eng", desc="", text="Lyrics")
+        self.assertEqual(misc.get_tags(audio)["lyrics"], "Lyrics")
+        self.assertTrue(misc.has_lyrics(audio))
+        audio["USLT:None:eng"] = id3.USLT(encoding=3, lang="eng", desc="None",
+                                          text="Our lyrics")
+        self.assertEqual(misc.get_tags(audio)["lyrics"], "Our lyrics")
+
+    def test_same_lyrics(self):
+        """Test detecting lyrics write which changes nothing"""
+        for mime in ['audio/mp3', 'audio/ogg']:
+            audio = fakers.FakeFile(mime, 'Artist', 'Album', 'Title')
+            self.assertFalse(misc.same_lyrics(audio, "Lyrics"))
+            audio = fakers.FakeFile(mime, 'Artist', 'Album', 'Title', 'Lyrics')
+            self.assertTrue(misc.same_lyrics(audio, "Lyrics"))
+            self.assertFalse(misc.same_lyrics(audio, "Other lyrics"))
+
+    def test_remove_lyrics_clean(self):
+        """Test remove_lyrics tells there was nothing to remove"""
+        audio = fakers.FakeFile('audio/ogg', 'Artist', 'Album', 'Title')
+        self.assertFalse(misc.remove_lyrics(audio))
+        audio = fakers.FakeFile('audio/ogg', 'Artist', 'Album', 'Title', 'Lyrics')
+        self.assertTrue(misc.remove_lyrics(audio))
+        self.assertFalse(misc.has_lyrics(audio))
+
+    def test_save_audio_padding(self):
+        """Test lyrics written after first save fit into padding"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, "song.flac")
+            fakers.make_flac(filepath)
+            audio = misc.get_audio(filepath)
+            misc.write_lyrics(audio, "Lyrics")
+            self.assertFalse(misc.save_audio(audio))
+            audio = misc.get_audio(filepath)
+            misc.write_lyrics(audio, "Longer lyrics " * 500)
+            self.assertTrue(misc.save_audio(audio))
+            audio = misc.get_audio(filepath)
+            misc.remove_lyrics(audio)
+            self.assertTrue(misc.save_audio(audio))
+    def test_fetch_hedged(self):
+        """Test hedged fetch keeps helpers order and doesn't wait for each helper"""
+        helpers = [SlowHelper(None, 0.2), SlowHelper("Second", 0.2),
+                   SlowHelper("Third", 0.0)]
+        with mock.patch('lyricstagger.helpers.HELPERS', helpers):
+            for delay, slowest in [(None, 0.4), (0.05, 0.3), (0, 0.3)]:
+                with mock.patch.object(misc, 'HEDGE_DELAY', delay):
+                    started = time.monotonic()
+                    self.assertEqual(misc.fetch("Artist", "Title", "Album"), "Second")
+                    elapsed = time.monotonic() - started
+                    if delay is None:
+                        self.assertGreaterEqual(elapsed, slowest)
+                    else:
+                        self.assertLess(elapsed, slowest)
+
+    def test_fetch_hedged_async(self):
+        """Test hedged fetch_async keeps helpers order"""
+        helpers = [SlowHelper(None, 0.1), SlowHelper("Second", 0.1),
+                   SlowHelper("Third", 0.0)]
+        loop = asyncio.new_event_loop()
+        try:
+            with mock.patch('lyricstagger.helpers.HELPERS', helpers):
+                with mock.patch.object(misc, 'HEDGE_DELAY', 0):
+                    started = time.monotonic()
+                    lyrics = loop.run_until_complete(
+                        misc.fetch_async("Artist", "Title", "Album"))
+                    self.assertLess(time.monotonic() - started, 0.2)
+        finally:
+            loop.close()
+        self.assertEqual(lyrics, "Second")
+
+    def test_fetch_hedged_async_same_album(self):
+        """Test lookup of album track, hedged by lookup of other track
+        which found lyrics elsewhere, isn't cancelled with the other one"""
+        class FirstHelper(object):
+            """Helper knowing lyrics only for Valhalla"""
+            url = "http://example.com"
+
+            async def fetch_async(self, artist, song, album, session=None):
+                await asyncio.sleep(0.01)
+                return "Valhalla lyrics" if song == "Valhalla" else None
+
+        def slow_get(url, params=None):
+            time.sleep(0.05)
+            return fakers.mock_get_darklyrics(url, params)
+
+        async def fetch_album():
+            return await asyncio.wait_for(asyncio.gather(
+                misc.fetch_async("Immortal", "Shores In Flames", "Blizzard Beasts"),
+                misc.fetch_async("Immortal", "Valhalla", "Blizzard Beasts")), 5)
+
+        helpers = [FirstHelper(), darklyrics.DarkLyrics()]
+        loop = asyncio.new_event_loop()
+        try:
+            with mock.patch('lyricstagger.helpers.HELPERS', helpers), \
+                    mock.patch.object(misc, 'HEDGE_DELAY', 0), \
+                    mock.patch.dict(network.LIMITERS, clear=True), \
+                    mock.patch.object(network, 'aiohttp', None), \
+                    mock.patch.object(network, 'SESSION', fakers.FakeSession(slow_get)):
+                results = loop.run_until_complete(fetch_album())
+        finally:
+            loop.close()
+        self.assertEqual(results, ["Mother winter leaves our land\nIt says: Set your sails",
+                                   "Valhalla lyrics"])
+
+
 # pylint: enable=R0904
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,133 @@
+"""
+Tests for lyrics_tagger
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+import os
+import struct
+import tempfile
+import unittest
+import mutagen
+from mutagen import id3
+import lyricstagger.index as index
+import lyricstagger.misc as misc
+import lyricstagger.probe as probe
+import test.fakers as fakers
+
+DATA = dict(artist="Artist", album="Album", title="Title")
+
+
+def ogg_page(serial: int, sequence: int, packet: bytes, header_type: int = 0,
+             complete: bool = True) -> bytes:
+    """Make Ogg page with one packet, continued on next page if not complete"""
+    segments = [255] * (len(packet) // 255)
+    if complete:
+        segments.append(len(packet) % 255)
+    return (b"OggS" + bytes([0, header_type]) + struct.pack("<qIII", 0, serial, sequence, 0) +
+            bytes([len(segments)]) + bytes(segments) + packet)
+
+
+def vorbis_comments(comments) -> bytes:
+    data = struct.pack("<I", 6) + b"vendor" + struct.pack("<I", len(comments))
+    for comment in comments:
+        comment = comment.encode("utf-8")
+        data += struct.pack("<I", len(comment)) + comment
+    return data
+
+
+# pylint: disable=R0904
+class ProbeCheck(unittest.TestCase):
+    """Test reading tags headers"""
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_mp3(self, version: int, desc: str = "None") -> str:
+        filepath = os.path.join(self.tmpdir.name, "song.mp3")
+        with open(filepath, "wb") as song:
+            # silent MPEG frames
+            song.write((b"\xff\xfb\x90\x64" + b"\x00" * 413) * 10)
+        tags = id3.ID3()
+        # big picture before tags we need
+        tags.add(id3.APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover",
+                          data=b"\xff" * 100000))
+        tags.add(id3.TPE1(encoding=1, text=["Artist", "Other"]))
+        tags.add(id3.TALB(encoding=3, text="Album"))
+        tags.add(id3.TIT2(encoding=0, text="Title"))
+        tags.add(id3.USLT(encoding=3, lang="eng", desc=desc, text="Lyrics"))
+        tags.save(filepath, v2_version=version)
+        return filepath
+
+    def test_probe_id3(self):
+        """Test probe of ID3v2.3 and ID3v2.4 tags"""
+        for version in [3, 4]:
+            filepath = self.make_mp3(version)
+            entry = probe.probe(filepath)
+            audio = misc.get_audio(filepath)
+            data = misc.get_tags(audio)
+            del data["lyrics"]
+            self.assertEqual(entry, index.Entry(data, misc.has_lyrics(audio)))
+            self.assertEqual(entry.data["title"], "Title")
+            self.assertTrue(entry.lyrics)
+
+    def test_probe_other_lyrics(self):
+        """Test probe and get_tags agree on lyrics with other description"""
+        filepath = self.make_mp3(4, desc="")
+        entry = probe.probe(filepath)
+        audio = misc.get_audio(filepath)
+        self.assertTrue(entry.lyrics)
+        self.assertEqual(misc.get_tags(audio)["lyrics"], "Lyrics")
+        self.assertTrue(misc.has_lyrics(audio))
+
+    def test_probe_id3v1(self):
+        """Test tags missing in ID3v2 tag are left to mutagen,
+        which finds them in ID3v1 tag"""
+        filepath = self.make_mp3(4)
+        tags = id3.ID3(filepath)
+        tags.delall("TALB")
+        tags.save(filepath, v1=id3.ID3v1SaveOptions.REMOVE)
+        with open(filepath, "ab") as song:
+            song.write(b"TAG" + b"\x00" * 60 + b"Album".ljust(30, b"\x00") +
+                       b"\x00" * 34 + b"\xff")
+        self.assertEqual(probe.probe(filepath), None)
+        self.assertEqual(misc.get_tags(misc.get_audio(filepath))["album"], "Album")
+
+    def test_probe_flac(self):
+        """Test probe of FLAC Vorbis comment block"""
+        filepath = os.path.join(self.tmpdir.name, "song.flac")
+        fakers.make_flac(filepath)
+        self.assertEqual(probe.probe(filepath), index.Entry(None, False))
+        audio = mutagen.File(filepath)
+        audio["artist"] = "Artist"
+        audio["album"] = "Album"
+        audio["title"] = "Title"
+        audio.save()
+        self.assertEqual(probe.probe(filepath), index.Entry(DATA, False))
+        audio["LYRICS"] = "Lyrics"
+        audio.save()
+        self.assertEqual(probe.probe(filepath), index.Entry(DATA, True))
+
+    def test_probe_ogg(self):
+        """Test probe of Ogg Vorbis comment header spanning pages"""
+        filepath = os.path.join(self.tmpdir.name, "song.ogg")
+        identification = (b"\x01vorbis" + struct.pack("<IBIiii", 0, 2, 44100, 0, 0, 0) +
+                          b"\xb8\x01")
+        comments = b"\x03vorbis" + vorbis_comments(
+            ["ARTIST=Artist", "Album=Album", "TITLE=Title",
+             "DESCRIPTION=" + "x" * 1000]) + b"\x01"
+        with open(filepath, "wb") as song:
+            song.write(ogg_page(1, 0, identification, header_type=2))
+            # comment packet continues on next page
+            song.write(ogg_page(1, 1, comments[:510], complete=False))
+            song.write(ogg_page(1, 2, comments[510:], header_type=1))
+        self.assertEqual(probe.probe(filepath), index.Entry(DATA, False))
+
+    def test_probe_unknown(self):
+        """Test files which should be opened by mutagen"""
+        filepath = os.path.join(self.tmpdir.name, "song.ogg")
+        open(filepath, "wb").close()
+        self.assertEqual(probe.probe(filepath), None)
+        self.assertEqual(probe.probe("test/test_data"), None)
+        self.assertEqual(probe.probe(os.path.join(self.tmpdir.name, "song.wav")), None)
@@ -0,0 +1,113 @@
+"""
+Tests for helpers ranking
+"""
+from __future__ import unicode_literals
+import os
+import tempfile
+import unittest
+import mock
+import lyricstagger.misc as misc
+import lyricstagger.ranking as ranking
+
+
+class Wikia(object):
+    """Helper knowing nothing"""
+    url = "http://lyrics.wikia.com"
+
+    def fetch(self, artist, song, album):
+        return None
+
+
+class DarkLyrics(object):
+    """Helper knowing metal artists"""
+    url = "http://www.darklyrics.com"
+
+    def fetch(self, artist, song, album):
+        if artist == "Immortal":
+            return "Lyrics"
+        return None
+
+
+class Local(object):
+    """Helper without network"""
+    url = None
+
+
+# pylint: disable=R0904
+class RankingCheck(unittest.TestCase):
+    """Test helpers ordering"""
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "helpers.json")
+        self.helpers = [Wikia(), DarkLyrics()]
+
+    def tearDown(self):
+        ranking.stop()
+        self.tmpdir.cleanup()
+
+    def test_order_by_hits(self):
+        """Test helper finding lyrics is moved first and it's remembered"""
+        rank = ranking.Ranking(self.path)
+        self.assertEqual(rank.order(self.helpers, "Immortal"), self.helpers)
+        for _ in range(5):
+            rank.record(self.helpers[0], "Immortal", False, 0.1)
+            rank.record(self.helpers[1], "Immortal", True, 0.1)
+        self.assertEqual(rank.order(self.helpers, "immortal"), self.helpers[::-1])
+        rank.save()
+        self.assertEqual(ranking.Ranking(self.path).order(self.helpers, "Other"),
+                         self.helpers[::-1])
+
+    def test_order_by_artist(self):
+        """Test artist statistics are used when there are enough of them"""
+        rank = ranking.Ranking(self.path)
+        for _ in range(10):
+            rank.record(self.helpers[0], "Pop", True, 0.1)
+            rank.record(self.helpers[1], "Pop", False, 0.1)
+        for _ in range(ranking.MIN_ARTIST_LOOKUPS):
+            rank.record(self.helpers[0], "Immortal", False, 0.5)
+            rank.record(self.helpers[1], "Immortal", True, 0.5)
+        self.assertEqual(rank.order(self.helpers, "Pop"), self.helpers)
+        self.assertEqual(rank.order(self.helpers, "Unknown"), self.helpers)
+        self.assertEqual(rank.order(self.helpers, "Immortal"), self.helpers[::-1])
+
+    def test_order_by_latency(self):
+        """Test faster helper goes first when hit rates are the same"""
+        rank = ranking.Ranking(self.path)
+        for _ in range(5):
+            rank.record(self.helpers[0], "Artist", True, 2.0)
+            rank.record(self.helpers[1], "Artist", True, 0.1)
+        self.assertEqual(rank.order(self.helpers, "Artist"), self.helpers[::-1])
+
+    def test_local_first(self):
+        """Test helper without network stays first whatever its hit rate"""
+        rank = ranking.Ranking(self.path)
+        local = Local()
+        helpers = [local] + self.helpers
+        for _ in range(100):
+            rank.record(local, "Artist", False, 0.5)
+            rank.record(self.helpers[1], "Artist", True, 0.1)
+        self.assertEqual(rank.order(helpers, "Artist"),
+                         [local, self.helpers[1], self.helpers[0]])
+
+    def test_fetch_reorders(self):
+        """Test fetch records lookups and asks better helper first"""
+        ranking.start(self.path)
+        with mock.patch('lyricstagger.helpers.HELPERS', self.helpers):
+            for song in range(5):
+                self.assertEqual(misc.fetch("Immortal", str(song), "Album"), "Lyrics")
+            with mock.patch.object(self.helpers[0], 'fetch') as fetch:
+                self.assertEqual(misc.fetch("Immortal", "Song", "Album"), "Lyrics")
+                self.assertFalse(fetch.called)
+        ranking.stop()
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_load_broken(self):
+        """Test broken statistics file is ignored"""
+        with open(self.path, "w") as stats_file:
+            stats_file.write("{broken")
+        rank = ranking.Ranking(self.path)
+        self.assertEqual(rank.order(self.helpers, "Artist"), self.helpers)
+
+
+if __name__ == '__main__':
+    unittest.main()
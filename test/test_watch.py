@@ -0,0 +1,52 @@
+"""
+Tests for lyrics_tagger
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+import os
+import sys
+import tempfile
+import unittest
+import lyricstagger.watch as watch
+
+
+# pylint: disable=R0904
+class DebouncerCheck(unittest.TestCase):
+    """Test waiting for files to stop changing"""
+    def test_ready(self):
+        """Test path gets ready after delay since last touch"""
+        debouncer = watch.Debouncer(2.0)
+        self.assertEqual(debouncer.timeout(0), None)
+        debouncer.touch("song.ogg", 0)
+        debouncer.touch("song.ogg", 1.5)
+        self.assertEqual(debouncer.ready(3), [])
+        self.assertEqual(debouncer.timeout(3), 0.5)
+        self.assertEqual(debouncer.ready(3.5), ["song.ogg"])
+        self.assertEqual(debouncer.ready(10), [])
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "requires inotify")
+class WatcherCheck(unittest.TestCase):
+    """Test watching directories with inotify"""
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_batches(self):
+        """Test new files are reported, unsupported ones are ignored"""
+        with watch.Watcher([self.tmpdir.name], delay=0.05) as watcher:
+            watcher.poll_interval = 0.05
+            album = os.path.join(self.tmpdir.name, "album")
+            os.mkdir(album)
+            for name in ["01.ogg", "02.mp3", "cover.jpg"]:
+                with open(os.path.join(album, name), "w") as song:
+                    song.write("audio")
+            found = []
+            for batch in watcher.batches():
+                found.extend(batch)
+                if len(found) >= 2:
+                    watcher.stop()
+        self.assertEqual(sorted(found), [os.path.join(album, "01.ogg"),
+                                         os.path.join(album, "02.mp3")])